@@ -15,13 +15,19 @@
 # Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA
 # 02111-1307, USA.
 
+import asyncio
+from collections import deque
 from dataclasses import dataclass
 from itertools import zip_longest
 from typing import (
+    Any,
+    Deque,
     Final,
     Generic,
     Iterable,
     Iterator,
+    List,
+    NamedTuple,
     Optional,
     Sequence,
     Tuple,
@@ -37,81 +43,99 @@ class _Level(Generic[N]):
     operations: Iterator[Operation]
 
 
+class Call(NamedTuple):
+    """A single callback invocation of `Apply` or `AsyncApply`."""
+
+    method: str
+    args: Tuple[Any, ...]
+
+
+def _calls(
+    adapter: Adapter[N], before: N, after: N, operations: Iterable[Operation]
+) -> Iterator[Call]:
+    stack = [
+        _Level(
+            before=[before],
+            after=[after],
+            operations=iter(operations),
+        )
+    ]
+
+    while stack:
+        level = stack[-1]
+        try:
+            op = next(level.operations)
+        except StopIteration:
+            stack.pop()
+
+            # Trigger ascend unless it's the root pair.
+            if stack:
+                yield Call("ascend", ())
+
+            continue
+
+        kids_before = level.before[op.i1 : op.i2]
+        kids_after = level.after[op.j1 : op.j2]
+
+        match op.tag:
+            case Tag.REPLACE if op.sub is not None:
+                assert 1 == len(kids_before)
+                assert 1 == len(kids_after)
+                yield Call(
+                    "edit_text", (kids_before[0], kids_after[0], op.sub)
+                )
+            case Tag.REPLACE:
+                yield Call("replace", (kids_before, kids_after))
+            case Tag.DELETE:
+                assert op.sub is None
+                assert len(kids_after) == 0, f"op: {op}"
+                assert len(kids_before) > 0, f"op: {op}"
+                yield Call("delete", (kids_before,))
+            case Tag.INSERT:
+                assert op.sub is None
+                assert len(kids_before) == 0, f"op: {op}"
+                assert len(kids_after) > 0, f"op: {op}"
+                yield Call("insert", (kids_after,))
+            case Tag.EQUAL:
+                assert op.sub is None
+                assert len(kids_before) > 0, f"op: {op}"
+                assert len(kids_after) > 0, f"op: {op}"
+                yield Call("equal", (kids_before, kids_after))
+            case Tag.DESCEND:
+                assert 1 == len(kids_before)
+                assert 1 == len(kids_after)
+                assert op.sub is not None, f"op: {op}"
+                stack.append(
+                    _Level(
+                        before=adapter.children(kids_before[0]),
+                        after=adapter.children(kids_after[0]),
+                        operations=iter(op.sub),
+                    )
+                )
+                yield Call("descend", (kids_before[0], kids_after[0]))
+
+
 class Apply(Generic[N]):
     def __init__(self, adapter: Adapter[N], before: N, after: N):
         self.adapter: Final[Adapter[N]] = adapter
         self.before: N = before
         self.after: N = after
 
-    def _kids(
-        self,
-        op: Operation,
-        stack: Sequence[_Level[N]],
-    ) -> Tuple[Sequence[N], Sequence[N]]:
-        return (
-            stack[-1].before[op.i1 : op.i2],
-            stack[-1].after[op.j1 : op.j2],
-        )
-
     def apply(self, operations: Iterable[Operation]) -> None:
-        stack = [
-            _Level(
-                before=[self.before],
-                after=[self.after],
-                operations=iter(operations),
-            )
-        ]
-
-        while stack:
-            level = stack[-1]
-            try:
-                op = next(level.operations)
-            except StopIteration:
-                stack.pop()
-
-                # Trigger ascend unless it's the root pair.
-                if stack:
-                    self.ascend()
-
-                continue
-
-            before, after = self._kids(op, stack)
-
-            match op.tag:
-                case Tag.REPLACE:
-                    assert op.sub is None
-                    self.replace(before, after)
-                case Tag.DELETE:
-                    assert op.sub is None
-                    assert len(after) == 0, f"op: {op}"
-                    assert len(before) > 0, f"op: {op}"
-                    self.delete(before)
-                case Tag.INSERT:
-                    assert op.sub is None
-                    assert len(before) == 0, f"op: {op}"
-                    assert len(after) > 0, f"op: {op}"
-                    self.insert(after)
-                case Tag.EQUAL:
-                    assert op.sub is None
-                    assert len(before) > 0, f"op: {op}"
-                    assert len(after) > 0, f"op: {op}"
-                    self.equal(before, after)
-                case Tag.DESCEND:
-                    assert 1 == len(before)
-                    assert 1 == len(after)
-                    assert op.sub is not None, f"op: {op}"
-                    stack.append(
-                        _Level(
-                            before=self.adapter.children(before[0]),
-                            after=self.adapter.children(after[0]),
-                            operations=iter(op.sub),
-                        )
-                    )
-                    self.descend(before[0], after[0])
+        for call in _calls(self.adapter, self.before, self.after, operations):
+            getattr(self, call.method)(*call.args)
 
     def replace(self, before: Sequence[N], after: Sequence[N]) -> None:
         pass
 
+    def edit_text(
+        self, before: N, after: N, operations: Sequence[Operation]
+    ) -> None:
+        """Replaces the text-bearing leaf `before` with `after`, where
+        `operations` transform the text of `before` into that of `after`
+        character by character. Falls back to `replace` by default."""
+        self.replace([before], [after])
+
     def delete(self, before: Sequence[N]) -> None:
         pass
 
@@ -126,3 +150,108 @@ class Apply(Generic[N]):
 
     def ascend(self) -> None:
         pass
+
+
+class AsyncApply(Generic[N]):
+    """Like `Apply`, but with coroutine callbacks.
+
+    Consecutive callbacks are coalesced into batches of up to `batch_size`
+    calls, which are handed to `deliver`. Up to `max_in_flight` batches may be
+    delivered concurrently. Batches are always started in order, so anything
+    `deliver` does before its first ``await`` (such as writing the batch to a
+    pipelined connection) happens in order. The default `deliver` invokes the
+    callbacks of a batch only once those of earlier batches have completed,
+    so callbacks never interleave unless `deliver` is overridden, and skips
+    every batch after one whose callbacks failed."""
+
+    def __init__(
+        self,
+        adapter: Adapter[N],
+        before: N,
+        after: N,
+        *,
+        batch_size: int = 1,
+        max_in_flight: int = 1,
+    ):
+        if batch_size < 1:
+            raise ValueError("batch_size must be at least one")
+        if max_in_flight < 1:
+            raise ValueError("max_in_flight must be at least one")
+
+        self.adapter: Final[Adapter[N]] = adapter
+        self.before: N = before
+        self.after: N = after
+        self.batch_size: Final[int] = batch_size
+        self.max_in_flight: Final[int] = max_in_flight
+        self._ordered = asyncio.Lock()
+        self._failed = False
+
+    async def apply(self, operations: Iterable[Operation]) -> None:
+        in_flight: Deque["asyncio.Task[None]"] = deque()
+        self._ordered = asyncio.Lock()
+        self._failed = False
+
+        async def dispatch(batch: List[Call]) -> None:
+            if len(in_flight) >= self.max_in_flight:
+                await in_flight.popleft()
+            in_flight.append(asyncio.create_task(self.deliver(batch)))
+
+        try:
+            batch: List[Call] = []
+            calls = _calls(self.adapter, self.before, self.after, operations)
+            for call in calls:
+                batch.append(call)
+                if len(batch) >= self.batch_size:
+                    await dispatch(batch)
+                    batch = []
+
+            if batch:
+                await dispatch(batch)
+
+            while in_flight:
+                await in_flight.popleft()
+        finally:
+            for task in in_flight:
+                task.cancel()
+            await asyncio.gather(*in_flight, return_exceptions=True)
+
+    async def deliver(self, calls: Sequence[Call]) -> None:
+        """Delivers a batch of calls. Invokes the callbacks one at a time and
+        after those of earlier batches by default; override to send the whole
+        batch in a single round trip."""
+        # `asyncio.Lock' wakes its waiters in order, and batches are started
+        # (and therefore queue up) in order.
+        async with self._ordered:
+            # Later batches would apply to a state the operations no longer
+            # describe.
+            if self._failed:
+                return
+            try:
+                for call in calls:
+                    await getattr(self, call.method)(*call.args)
+            except BaseException:
+                self._failed = True
+                raise
+
+    async def replace(self, before: Sequence[N], after: Sequence[N]) -> None:
+        pass
+
+    async def edit_text(
+        self, before: N, after: N, operations: Sequence[Operation]
+    ) -> None:
+        await self.replace([before], [after])
+
+    async def delete(self, before: Sequence[N]) -> None:
+        pass
+
+    async def insert(self, after: Sequence[N]) -> None:
+        pass
+
+    async def equal(self, before: Sequence[N], after: Sequence[N]) -> None:
+        pass
+
+    async def descend(self, before: N, after: N) -> None:
+        pass
+
+    async def ascend(self) -> None:
+        pass
@@ -0,0 +1,181 @@
+# Copyright 2023 Sam Wilson
+#
+# fladrif is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published
+# by the Free Software Foundation; either version 2 of the License,
+# or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA
+# 02111-1307, USA.
+
+from typing import Dict, Final, Generic, List, Sequence, Tuple
+
+from .flat import FlatAdapter, FlatTree
+from .treediff import Adapter, Engine, N, Operation, Tag, _equal, _gap
+
+
+class EditDistance(Engine[N]):
+    """Computes a patch of minimal cost, where inserting or deleting a
+    subtree costs `insert_cost` or `delete_cost` per node, and descending into
+    a pair of nodes which are not shallow-equal costs `rename_cost`.
+
+    Operations can only delete or insert whole subtrees, so the distance is
+    the top-down (Selkow) tree edit distance: the cheapest patch expressible
+    as operations. Time and memory are quadratic in the number of nodes in the
+    worst case."""
+
+    def __init__(
+        self,
+        *,
+        insert_cost: float = 1.0,
+        delete_cost: float = 1.0,
+        rename_cost: float = 1.0,
+    ) -> None:
+        self.insert_cost: Final[float] = insert_cost
+        self.delete_cost: Final[float] = delete_cost
+        self.rename_cost: Final[float] = rename_cost
+
+    def compute_operations(
+        self, adapter: Adapter[N], before: N, after: N
+    ) -> Sequence[Operation]:
+        return _Solver(self, FlatTree(adapter, before, after)).solve()
+
+
+class _Solver(Generic[N]):
+    def __init__(self, costs: EditDistance[N], tree: FlatTree[N]) -> None:
+        self.costs: Final[EditDistance[N]] = costs
+        self.tree: Final[FlatTree[N]] = tree
+        self.adapter: Final[FlatAdapter[N]] = FlatAdapter(tree)
+        self.distances: Final[Dict[Tuple[int, int], float]] = {}
+
+    def solve(self) -> List[Operation]:
+        before, after = self.tree.roots
+        result: List[Operation] = []
+        if self.distance(before, after) <= self.replace(before, after):
+            result.append(
+                Operation(
+                    tag=Tag.DESCEND,
+                    i1=0,
+                    i2=1,
+                    j1=0,
+                    j2=1,
+                    sub=self.operations(before, after),
+                )
+            )
+        else:
+            _gap(result, 0, 1, 0, 1)
+        return result
+
+    def replace(self, before: int, after: int) -> float:
+        size = self.tree.size
+        return (
+            self.costs.delete_cost * size[before]
+            + self.costs.insert_cost * size[after]
+        )
+
+    def distance(self, before: int, after: int) -> float:
+        """Cost of descending into `before` and `after`."""
+        key = (before, after)
+        value = self.distances.get(key)
+        if value is not None:
+            return value
+
+        if self.adapter.deep_equals(before, after):
+            value = 0.0
+        else:
+            value = self.table(before, after)[-1][-1]
+            if not self.adapter.shallow_equals(before, after):
+                value += self.costs.rename_cost
+
+        self.distances[key] = value
+        return value
+
+    def table(self, before: int, after: int) -> List[List[float]]:
+        """Aligns the children of `before` and `after`, where `table[x][y]`
+        is the cost of transforming the first `x` children of `before` into
+        the first `y` children of `after`."""
+        tree = self.tree
+        lefts = tree.children(before)
+        rights = tree.children(after)
+        delete = self.costs.delete_cost
+        insert = self.costs.insert_cost
+
+        table = [[0.0] * (len(rights) + 1)]
+        for y, right in enumerate(rights):
+            table[0][y + 1] = table[0][y] + insert * tree.size[right]
+
+        for x, left in enumerate(lefts):
+            row = [table[x][0] + delete * tree.size[left]]
+            for y, right in enumerate(rights):
+                row.append(
+                    min(
+                        table[x][y + 1] + delete * tree.size[left],
+                        row[y] + insert * tree.size[right],
+                        table[x][y] + self.distance(left, right),
+                    )
+                )
+            table.append(row)
+
+        return table
+
+    def operations(self, before: int, after: int) -> List[Operation]:
+        """Recovers the operations for the children of `before` and `after`
+        from their alignment."""
+        tree = self.tree
+        lefts = tree.children(before)
+        rights = tree.children(after)
+
+        result: List[Operation] = []
+        if self.adapter.deep_equals(before, after):
+            if lefts:
+                _equal(result, 0, 0, len(lefts))
+            return result
+
+        table = self.table(before, after)
+
+        pairs = []
+        x = len(lefts)
+        y = len(rights)
+        while x and y:
+            left = lefts[x - 1]
+            right = rights[y - 1]
+            if table[x][y] == table[x - 1][y - 1] + self.distance(left, right):
+                x -= 1
+                y -= 1
+                pairs.append((x, y))
+            elif table[x][y] == table[x - 1][y] + (
+                self.costs.delete_cost * tree.size[left]
+            ):
+                x -= 1
+            else:
+                y -= 1
+        pairs.reverse()
+
+        aDone = 0
+        bDone = 0
+        for x, y in pairs:
+            _gap(result, aDone, x, bDone, y)
+            if self.adapter.deep_equals(lefts[x], rights[y]):
+                _equal(result, x, y, 1)
+            else:
+                result.append(
+                    Operation(
+                        tag=Tag.DESCEND,
+                        i1=x,
+                        i2=x + 1,
+                        j1=y,
+                        j2=y + 1,
+                        sub=self.operations(lefts[x], rights[y]),
+                    )
+                )
+            aDone = x + 1
+            bDone = y + 1
+        _gap(result, aDone, len(lefts), bDone, len(rights))
+        return result
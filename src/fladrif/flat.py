@@ -0,0 +1,145 @@
+# Copyright 2023 Sam Wilson
+#
+# fladrif is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published
+# by the Free Software Foundation; either version 2 of the License,
+# or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA
+# 02111-1307, USA.
+
+from array import array
+from typing import Final, Generic, Hashable, List, Optional, Tuple
+
+from .treediff import Adapter, N
+
+
+class FlatTree(Generic[N]):
+    """Compact pre-order representation of one or more trees exposed through
+    an `Adapter'. Nodes are identified by their pre-order index, and the
+    structure is stored in flat integer columns instead of Python objects."""
+
+    def __init__(self, adapter: Adapter[N], *roots: N) -> None:
+        self.adapter: Final[Adapter[N]] = adapter
+        self.nodes: Final[List[N]] = []
+        self.roots: Final[List[int]] = []
+        self.parent: Final["array[int]"] = array("q")
+        self.size: Final["array[int]"] = array("q")
+        self.first_child: Final["array[int]"] = array("q")
+        self.shallow: Final["array[int]"] = array("q")
+        self.digest: Final["array[int]"] = array("q")
+
+        for root in roots:
+            self.roots.append(len(self.nodes))
+            stack: List[Tuple[int, N]] = [(-1, root)]
+            while stack:
+                parent, node = stack.pop()
+                self.nodes.append(node)
+                self.parent.append(parent)
+                # Adapters may return hashes outside of the column's range.
+                self.shallow.append(hash(adapter.shallow_hash(node)))
+
+                # Opaque nodes are stored as leaves.
+                if adapter.opaque(node):
+                    continue
+
+                index = len(self.nodes) - 1
+                children = adapter.children(node)
+                for kid in reversed(children):
+                    stack.append((index, kid))
+
+        count = len(self.nodes)
+        self.size.extend([1] * count)
+        self.first_child.extend([-1] * count)
+        self.digest.extend(self.shallow)
+
+        # Children always follow their parent in pre-order, so a single
+        # reverse sweep visits every subtree before its root.
+        size = self.size
+        parent_col = self.parent
+        for index in range(count - 1, -1, -1):
+            parent = parent_col[index]
+            if parent >= 0:
+                size[parent] += size[index]
+
+        first_child = self.first_child
+        digest = self.digest
+        for index in range(count - 1, -1, -1):
+            end = index + size[index]
+            child = index + 1
+            if child < end:
+                first_child[index] = child
+            value = digest[index]
+            while child < end:
+                value = hash((value, digest[child]))
+                child += size[child]
+            digest[index] = value
+
+    def __len__(self) -> int:
+        return len(self.nodes)
+
+    def children(self, index: int) -> List[int]:
+        result = []
+        end = index + self.size[index]
+        child = index + 1
+        while child < end:
+            result.append(child)
+            child += self.size[child]
+        return result
+
+
+class FlatAdapter(Generic[N], Adapter[int]):
+    """Adapts a `FlatTree' so that `TreeMatcher' runs off its columns.
+    Digests are precomputed, so deep hashing is a lookup and deep equality is
+    a linear scan over the pre-order ranges."""
+
+    def __init__(self, tree: FlatTree[N]) -> None:
+        self.tree: Final[FlatTree[N]] = tree
+
+    def deep_equals(self, lhs: int, rhs: int) -> bool:
+        if lhs == rhs:
+            return True
+
+        tree = self.tree
+        size = tree.size
+        if size[lhs] != size[rhs] or tree.digest[lhs] != tree.digest[rhs]:
+            return False
+
+        # Matching sizes at every pre-order position imply the same shape.
+        for offset in range(size[lhs]):
+            left = lhs + offset
+            right = rhs + offset
+            if size[left] != size[right]:
+                return False
+            if not self.shallow_equals(left, right):
+                return False
+
+        return True
+
+    def deep_hash(self, node: int) -> int:
+        return self.tree.digest[node]
+
+    def text(self, node: int) -> Optional[str]:
+        return self.tree.adapter.text(self.tree.nodes[node])
+
+    def key(self, node: int) -> Optional[Hashable]:
+        return self.tree.adapter.key(self.tree.nodes[node])
+
+    def shallow_equals(self, lhs: int, rhs: int) -> bool:
+        tree = self.tree
+        if tree.shallow[lhs] != tree.shallow[rhs]:
+            return False
+        return tree.adapter.shallow_equals(tree.nodes[lhs], tree.nodes[rhs])
+
+    def shallow_hash(self, node: int) -> int:
+        return self.tree.shallow[node]
+
+    def children(self, node: int) -> List[int]:
+        return self.tree.children(node)
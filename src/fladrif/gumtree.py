@@ -0,0 +1,198 @@
+# Copyright 2023 Sam Wilson
+#
+# fladrif is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published
+# by the Free Software Foundation; either version 2 of the License,
+# or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA
+# 02111-1307, USA.
+
+from typing import Dict, Final, Generic, List, Sequence
+
+from .flat import FlatAdapter, FlatTree
+from .treediff import (
+    Adapter,
+    Engine,
+    N,
+    Operation,
+    Tag,
+    _equal,
+    _gap,
+    _increasing,
+)
+
+
+class GumTree(Engine[N]):
+    """Fast approximate matcher for very large trees, after GumTree.
+
+    A top-down phase greedily matches the largest identical subtrees by their
+    digests. A bottom-up phase then matches shallow-equal containers by the
+    ratio of descendants they have in common (at least `min_dice`). Both
+    phases run in roughly O(n log n).
+
+    Operations cannot express moves, so matched nodes which changed parents
+    or order are deleted and inserted again."""
+
+    def __init__(self, *, min_height: int = 1, min_dice: float = 0.5) -> None:
+        self.min_height: Final[int] = min_height
+        self.min_dice: Final[float] = min_dice
+
+    def compute_operations(
+        self, adapter: Adapter[N], before: N, after: N
+    ) -> Sequence[Operation]:
+        return _Mapping(self, FlatTree(adapter, before, after)).operations()
+
+
+class _Mapping(Generic[N]):
+    def __init__(self, options: GumTree[N], tree: FlatTree[N]) -> None:
+        self.tree: Final[FlatTree[N]] = tree
+        self.adapter: Final[FlatAdapter[N]] = FlatAdapter(tree)
+        self.mapping: Final[List[int]] = [-1] * len(tree)
+
+        self.before: Final[int] = tree.roots[0]
+        self.after: Final[int] = tree.roots[1]
+
+        self.top_down(options.min_height)
+        self.bottom_up(options.min_dice)
+
+    def match(self, before: int, after: int) -> None:
+        self.mapping[before] = after
+        self.mapping[after] = before
+
+    def top_down(self, min_height: int) -> None:
+        tree = self.tree
+        height = [1] * len(tree)
+        for index in range(len(tree) - 1, -1, -1):
+            parent = tree.parent[index]
+            if parent >= 0:
+                height[parent] = max(height[parent], height[index] + 1)
+
+        candidates: Dict[int, List[int]] = {}
+        for index in range(self.after, len(tree)):
+            if height[index] >= min_height:
+                candidates.setdefault(tree.digest[index], []).append(index)
+
+        # Largest subtrees first, so that descendants of a matched subtree
+        # never need to be considered on their own.
+        order = sorted(
+            range(self.before, self.after), key=lambda i: -tree.size[i]
+        )
+        offsets: Dict[int, int] = {}
+        for before in order:
+            if height[before] < min_height or self.mapping[before] >= 0:
+                continue
+
+            found = candidates.get(tree.digest[before])
+            if not found:
+                continue
+
+            # Ambiguous subtrees are paired in document order.
+            offset = offsets.get(tree.digest[before], 0)
+            while offset < len(found):
+                after = found[offset]
+                offset += 1
+                if self.mapping[after] >= 0:
+                    continue
+                if not self.adapter.deep_equals(before, after):
+                    continue
+
+                for step in range(tree.size[before]):
+                    self.match(before + step, after + step)
+                break
+            offsets[tree.digest[before]] = offset
+
+    def bottom_up(self, min_dice: float) -> None:
+        tree = self.tree
+        if self.mapping[self.before] < 0:
+            if self.adapter.shallow_equals(self.before, self.after):
+                self.match(self.before, self.after)
+
+        # Reverse pre-order visits every child before its parent.
+        for before in range(self.after - 1, self.before - 1, -1):
+            if self.mapping[before] >= 0:
+                continue
+
+            votes: Dict[int, int] = {}
+            for child in tree.children(before):
+                image = self.mapping[child]
+                if image >= 0:
+                    parent = tree.parent[image]
+                    if parent >= 0 and self.mapping[parent] < 0:
+                        votes[parent] = votes.get(parent, 0) + 1
+            if not votes:
+                continue
+
+            after = max(votes, key=lambda k: (votes[k], -k))
+            if not self.adapter.shallow_equals(before, after):
+                continue
+
+            end = after + tree.size[after]
+            common = 0
+            for descendant in range(before + 1, before + tree.size[before]):
+                image = self.mapping[descendant]
+                if after < image < end:
+                    common += 1
+
+            total = tree.size[before] + tree.size[after] - 2
+            if 2.0 * common >= min_dice * total:
+                self.match(before, after)
+
+    def operations(self) -> List[Operation]:
+        result: List[Operation] = []
+        if self.mapping[self.before] == self.after:
+            result.append(
+                Operation(
+                    tag=Tag.DESCEND,
+                    i1=0,
+                    i2=1,
+                    j1=0,
+                    j2=1,
+                    sub=self.children(self.before, self.after),
+                )
+            )
+        else:
+            _gap(result, 0, 1, 0, 1)
+        return result
+
+    def children(self, before: int, after: int) -> List[Operation]:
+        tree = self.tree
+        lefts = tree.children(before)
+        rights = tree.children(after)
+        position = {node: index for index, node in enumerate(rights)}
+
+        pairs = []
+        for x, left in enumerate(lefts):
+            y = position.get(self.mapping[left], -1)
+            if y >= 0:
+                pairs.append((x, y))
+
+        result: List[Operation] = []
+        aDone = 0
+        bDone = 0
+        for x, y in _increasing(pairs):
+            _gap(result, aDone, x, bDone, y)
+            if self.adapter.deep_equals(lefts[x], rights[y]):
+                _equal(result, x, y, 1)
+            else:
+                result.append(
+                    Operation(
+                        tag=Tag.DESCEND,
+                        i1=x,
+                        i2=x + 1,
+                        j1=y,
+                        j2=y + 1,
+                        sub=self.children(lefts[x], rights[y]),
+                    )
+                )
+            aDone = x + 1
+            bDone = y + 1
+        _gap(result, aDone, len(lefts), bDone, len(rights))
+        return result
@@ -0,0 +1,132 @@
+# Copyright 2023 Sam Wilson
+#
+# fladrif is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published
+# by the Free Software Foundation; either version 2 of the License,
+# or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA
+# 02111-1307, USA.
+
+from typing import Final, List, Sequence, Tuple
+
+from .treediff import Operation, Tag, _equal, _gap
+
+_DIAGONAL: Final[Tuple[Tag, ...]] = (Tag.EQUAL, Tag.DESCEND)
+
+
+def invert(operations: Sequence[Operation]) -> List[Operation]:
+    """Returns operations transforming the `after' tree of `operations' back
+    into its `before' tree. Runs in time proportional to the patch size."""
+    result = []
+    for op in operations:
+        if op.tag == Tag.INSERT:
+            tag = Tag.DELETE
+        elif op.tag == Tag.DELETE:
+            tag = Tag.INSERT
+        else:
+            tag = op.tag
+
+        sub = None if op.sub is None else invert(op.sub)
+        result.append(
+            Operation(tag=tag, i1=op.j1, i2=op.j2, j1=op.i1, j2=op.i2, sub=sub)
+        )
+    return result
+
+
+def compose(
+    first: Sequence[Operation], second: Sequence[Operation]
+) -> List[Operation]:
+    """Returns operations equivalent to applying `first' and then `second',
+    without materializing the intermediate tree.
+
+    The `after' indices of `first' and the `before' indices of `second' must
+    refer to the same (intermediate) tree. Index ranges are merged level by
+    level, so this runs in time proportional to the size of both patches."""
+    middle = _extent(first, after=True)
+    if middle != _extent(second, after=False):
+        raise ValueError(
+            "patches do not share an intermediate tree"
+            f" ({middle} != {_extent(second, after=False)})"
+        )
+
+    result: List[Operation] = []
+    done_i = 0
+    done_j = 0
+    x = 0
+    y = 0
+
+    while x < len(first) and y < len(second):
+        lhs = first[x]
+        rhs = second[y]
+
+        lo = max(lhs.j1, rhs.i1)
+        hi = min(lhs.j2, rhs.i2)
+
+        # Only intermediate nodes with a counterpart on both sides survive as
+        # anchors. Everything between two anchors becomes a gap.
+        if lo < hi and lhs.tag in _DIAGONAL and rhs.tag in _DIAGONAL:
+            i1 = lhs.i1 + lo - lhs.j1
+            j1 = rhs.j1 + lo - rhs.i1
+            _gap(result, done_i, i1, done_j, j1)
+            _anchor(result, lhs, rhs, i1, j1, hi - lo)
+            done_i = i1 + hi - lo
+            done_j = j1 + hi - lo
+
+        if lhs.j2 <= rhs.i2:
+            x += 1
+        if rhs.i2 <= lhs.j2:
+            y += 1
+
+    _gap(
+        result,
+        done_i,
+        _extent(first, after=False),
+        done_j,
+        _extent(second, after=True),
+    )
+    return result
+
+
+def _extent(operations: Sequence[Operation], *, after: bool) -> int:
+    if not operations:
+        return 0
+    last = operations[-1]
+    return last.j2 if after else last.i2
+
+
+def _anchor(
+    result: List[Operation],
+    lhs: Operation,
+    rhs: Operation,
+    i1: int,
+    j1: int,
+    length: int,
+) -> None:
+    if lhs.tag == Tag.EQUAL and rhs.tag == Tag.EQUAL:
+        _equal(result, i1, j1, length)
+        return
+
+    assert length == 1, f"lhs: {lhs}, rhs: {rhs}"
+
+    # An `EQUAL' node is deeply equal on both sides, so the other side's
+    # nested operations apply to it unchanged.
+    if lhs.tag == Tag.EQUAL:
+        sub = rhs.sub
+    elif rhs.tag == Tag.EQUAL:
+        sub = lhs.sub
+    else:
+        assert lhs.sub is not None
+        assert rhs.sub is not None
+        sub = compose(lhs.sub, rhs.sub)
+
+    result.append(
+        Operation(tag=Tag.DESCEND, i1=i1, i2=i1 + 1, j1=j1, j2=j1 + 1, sub=sub)
+    )
@@ -17,13 +17,17 @@
 # 02111-1307, USA.
 
 from abc import ABC, abstractmethod
-from collections import deque
+from bisect import bisect_left
+from collections import Counter, OrderedDict, deque
 from contextlib import contextmanager
 from difflib import SequenceMatcher
 from enum import IntEnum, auto
 from typing import (
+    Dict,
     Final,
     Generic,
+    Hashable,
+    Iterable,
     Iterator,
     List,
     NamedTuple,
@@ -39,55 +43,209 @@ N = TypeVar("N")
 
 class Adapter(ABC, Generic[N]):
     def deep_equals(self, lhs: N, rhs: N) -> bool:
-        if lhs is rhs:
-            return True
+        return _compare(self, lhs, rhs, None)
 
-        if not self.shallow_equals(lhs, rhs):
-            return False
+    def deep_hash(self, node: N) -> int:
+        return _digest(self, node, {})
 
-        stack = deque([(self.children(lhs), self.children(rhs))])
+    def text(self, node: N) -> Optional[str]:
+        """Returns the text carried by the leaf `node`, or `None`. Replaced
+        text-bearing leaves get a character-level edit script."""
+        return None
 
-        while stack:
-            lefts, rights = stack.popleft()
-            if len(lefts) != len(rights):
-                return False
+    def key(self, node: N) -> Optional[Hashable]:
+        """Returns a key identifying `node` among its siblings, or `None`.
+        When every child of a node has a distinct key, children are aligned
+        by key instead of by content."""
+        return None
 
-            for left, right in zip(lefts, rights):
-                if not self.shallow_equals(left, right):
-                    return False
-                stack.append((self.children(left), self.children(right)))
+    def opaque(self, node: N) -> bool:
+        """Returns whether the children of `node` should be disregarded.
+        Opaque nodes are compared, hashed and matched by their shallow
+        properties alone, and are never descended into. Volatile subtrees
+        (timestamps, generated ids, ...) can be ignored entirely by marking
+        them opaque and leaving the volatile parts out of `shallow_equals`
+        and `shallow_hash`."""
+        return False
+
+    @abstractmethod
+    def shallow_equals(self, lhs: N, rhs: N) -> bool:
+        raise NotImplementedError()
+
+    @abstractmethod
+    def shallow_hash(self, node: N) -> int:
+        raise NotImplementedError()
+
+    @abstractmethod
+    def children(self, node: N) -> Sequence[N]:
+        raise NotImplementedError()
+
+
+def _digest(
+    adapter: Adapter[N], node: N, memo: Dict[int, Tuple[N, int]]
+) -> int:
+    """Computes a Merkle-style digest of `node`, remembering the digest of
+    every visited node in `memo` by identity. Nodes shared between several
+    parents are therefore only visited once."""
+    found = memo.get(id(node))
+    if found is not None:
+        return found[1]
+
+    stack: List[Tuple[N, Optional[Sequence[N]]]] = [(node, None)]
+    while stack:
+        current, children = stack.pop()
+        if id(current) in memo:
+            continue
+
+        if children is None:
+            if adapter.opaque(current):
+                children = ()
+            else:
+                children = adapter.children(current)
+            stack.append((current, children))
+            for child in children:
+                if id(child) not in memo:
+                    stack.append((child, None))
+            continue
+
+        value = adapter.shallow_hash(current)
+        for child in children:
+            value = hash((value, memo[id(child)][1]))
+        memo[id(current)] = (current, value)
+
+    return memo[id(node)][1]
 
+
+def _compare(
+    adapter: Adapter[N],
+    lhs: N,
+    rhs: N,
+    memo: Optional[Dict[Tuple[int, int], Tuple[N, N, bool]]],
+) -> bool:
+    """Compares `lhs` and `rhs` deeply, stopping at the first difference.
+    Pairs reachable along several paths (in trees which share nodes) are only
+    compared once. If given, `memo` remembers results by the identities of
+    the compared pairs across calls. Pairs are kept alive alongside their
+    ids, since adapters may create child objects on demand and ids of freed
+    objects are reused."""
+    if lhs is rhs:
         return True
 
-    def deep_hash(self, node: N) -> int:
-        # TODO: This is not an ideal way to calculate hashes.
+    top = (id(lhs), id(rhs))
+    known = {} if memo is None else memo
+    found = known.get(top)
+    if found is not None:
+        return found[2]
 
-        value = 0
-        count = 0
-        stack = [(0, node)]
+    result = adapter.shallow_equals(lhs, rhs)
+    seen = {top: (lhs, rhs)}
+    stack = deque([(lhs, rhs)])
 
-        while stack:
-            (depth, current) = stack.pop()
-            count += 1
+    while result and stack:
+        left, right = stack.popleft()
+        if adapter.opaque(left) or adapter.opaque(right):
+            continue
+
+        lefts = adapter.children(left)
+        rights = adapter.children(right)
+        if len(lefts) != len(rights):
+            result = False
+            break
+
+        for lchild, rchild in zip(lefts, rights):
+            if lchild is rchild:
+                continue
+            key = (id(lchild), id(rchild))
+            if key in seen:
+                continue
+            found = known.get(key)
+            if found is not None and found[2]:
+                continue
+            if found is not None or not adapter.shallow_equals(lchild, rchild):
+                result = False
+                break
+            seen[key] = (lchild, rchild)
+            stack.append((lchild, rchild))
+
+    if memo is not None:
+        if result:
+            # Every pair visited along the way is deeply equal as well.
+            for key, (left, right) in seen.items():
+                memo[key] = (left, right, True)
+        else:
+            memo[top] = (lhs, rhs, False)
+    return result
+
+
+class _Memo(Adapter[N]):
+    """Delegates to `adapter`, remembering deep hashes and deep equality by
+    node identity for as long as the memo lives."""
+
+    def __init__(self, adapter: Adapter[N]) -> None:
+        self.adapter: Final[Adapter[N]] = adapter
+        self._digests: Final[Dict[int, Tuple[N, int]]] = {}
+        self._equal: Final[Dict[Tuple[int, int], Tuple[N, N, bool]]] = {}
+        self._merkle: Final[bool] = (
+            type(adapter).deep_hash is Adapter.deep_hash
+        )
+        self._custom: Final[bool] = (
+            type(adapter).deep_equals is not Adapter.deep_equals
+        )
 
-            value ^= hash((depth, count, self.shallow_hash(current)))
+    def deep_equals(self, lhs: N, rhs: N) -> bool:
+        if lhs is rhs:
+            return True
+
+        key = (id(lhs), id(rhs))
+        found = self._equal.get(key)
+        if found is not None:
+            return found[2]
+
+        # Digests are only compared if both are known already. Computing them
+        # would visit both trees in full, where comparing stops at the first
+        # difference.
+        lhash = self._digests.get(id(lhs))
+        rhash = self._digests.get(id(rhs))
+        if lhash is not None and rhash is not None and lhash[1] != rhash[1]:
+            self._equal[key] = (lhs, rhs, False)
+            return False
 
-            for child in self.children(current):
-                stack.append((depth + 1, child))
+        if self._custom:
+            result = self.adapter.deep_equals(lhs, rhs)
+            self._equal[key] = (lhs, rhs, result)
+            return result
 
+        return _compare(self.adapter, lhs, rhs, self._equal)
+
+    def deep_hash(self, node: N) -> int:
+        if self._merkle:
+            return _digest(self.adapter, node, self._digests)
+
+        found = self._digests.get(id(node))
+        if found is not None:
+            return found[1]
+
+        value = self.adapter.deep_hash(node)
+        self._digests[id(node)] = (node, value)
         return value
 
-    @abstractmethod
+    def text(self, node: N) -> Optional[str]:
+        return self.adapter.text(node)
+
+    def key(self, node: N) -> Optional[Hashable]:
+        return self.adapter.key(node)
+
+    def opaque(self, node: N) -> bool:
+        return self.adapter.opaque(node)
+
     def shallow_equals(self, lhs: N, rhs: N) -> bool:
-        raise NotImplementedError()
+        return self.adapter.shallow_equals(lhs, rhs)
 
-    @abstractmethod
     def shallow_hash(self, node: N) -> int:
-        raise NotImplementedError()
+        return self.adapter.shallow_hash(node)
 
-    @abstractmethod
     def children(self, node: N) -> Sequence[N]:
-        raise NotImplementedError()
+        return self.adapter.children(node)
 
 
 class _Wrap(ABC, Generic[N]):
@@ -104,6 +262,9 @@ class _Wrap(ABC, Generic[N]):
         if not isinstance(other, type(self)):
             return NotImplemented
 
+        if self.node is other.node:
+            return True
+
         if self._hash is not None and other._hash is not None:
             if self._hash != other._hash:
                 return False
@@ -152,10 +313,14 @@ class _Deep(Generic[N], _Wrap[N]):
 class _ModeStack(Generic[N]):
     stack: Final[List[bool]]
 
-    def __init__(self, adapter: Adapter[N]):
+    def __init__(self, adapter: Adapter[N], *, shared: bool = False):
         self.adapter: Final[Adapter[N]] = adapter
         self.stack = [False]
 
+        # Answers deep hashes and deep equality, remembering them by node
+        # identity if nodes are shared.
+        self.deep: Final[Adapter[N]] = _Memo(adapter) if shared else adapter
+
     @contextmanager
     def push(self, *, shallow: bool) -> Iterator[None]:
         self.stack.append(shallow)
@@ -166,13 +331,15 @@ class _ModeStack(Generic[N]):
             assert shallow == popped
 
     def children(self, node: N) -> Sequence[N]:
+        if self.adapter.opaque(node):
+            return ()
         return self.adapter.children(node)
 
     def wrap(self, node: N) -> _Wrap[N]:
         if self.stack[-1]:
             return _Shallow(self.adapter, node)
         else:
-            return _Deep(self.adapter, node)
+            return _Deep(self.deep, node)
 
     def wrap_all(self, nodes: Sequence[N]) -> List[_Wrap[N]]:
         return [self.wrap(n) for n in nodes]
@@ -224,17 +391,312 @@ class Operation(BaseOperation):
         return cls(tag=tag, i1=v[1], i2=v[2], j1=v[3], j2=v[4], sub=None)
 
 
+def _gap(result: List[Operation], i1: int, i2: int, j1: int, j2: int) -> None:
+    """Appends the operation replacing `i1:i2` with `j1:j2`, if any."""
+    tag: Optional[Tag]
+    if i1 < i2 and j1 < j2:
+        tag = Tag.REPLACE
+    elif i1 < i2:
+        tag = Tag.DELETE
+    elif j1 < j2:
+        tag = Tag.INSERT
+    else:
+        tag = None
+
+    if tag is not None:
+        result.append(Operation(tag=tag, i1=i1, i2=i2, j1=j1, j2=j2, sub=None))
+
+
+def _equal(result: List[Operation], i1: int, j1: int, length: int) -> None:
+    """Appends an ``equal`` operation, extending the last one if possible."""
+    if result:
+        last = result[-1]
+        if last.tag == Tag.EQUAL and last.i2 == i1 and last.j2 == j1:
+            result[-1] = last._replace(i2=i1 + length, j2=j1 + length)
+            return
+    result.append(
+        Operation(
+            tag=Tag.EQUAL,
+            i1=i1,
+            i2=i1 + length,
+            j1=j1,
+            j2=j1 + length,
+            sub=None,
+        )
+    )
+
+
+def _trim(a: Sequence[_Wrap[N]], b: Sequence[_Wrap[N]]) -> Tuple[int, int]:
+    """Returns the lengths of the runs of equal elements at the start and at
+    the end of `a` and `b`, which don't overlap."""
+    limit = min(len(a), len(b))
+    head = 0
+    while head < limit and a[head] == b[head]:
+        head += 1
+
+    tail = 0
+    while tail < limit - head and a[-1 - tail] == b[-1 - tail]:
+        tail += 1
+
+    return head, tail
+
+
+def _increasing(pairs: Sequence[Tuple[int, int]]) -> List[Tuple[int, int]]:
+    """Returns the longest subsequence of `pairs` (sorted by their first
+    element) whose second elements are strictly increasing."""
+    tails: List[int] = []
+    tail_idx: List[int] = []
+    prev: List[int] = []
+    for idx, (_, j) in enumerate(pairs):
+        pos = bisect_left(tails, j)
+        if pos == len(tails):
+            tails.append(j)
+            tail_idx.append(idx)
+        else:
+            tails[pos] = j
+            tail_idx[pos] = idx
+        prev.append(tail_idx[pos - 1] if pos else -1)
+
+    result = []
+    idx = tail_idx[-1] if tail_idx else -1
+    while idx >= 0:
+        result.append(pairs[idx])
+        idx = prev[idx]
+    result.reverse()
+    return result
+
+
+class Engine(ABC, Generic[N]):
+    """Alternative algorithm for `TreeMatcher.compute_operations`."""
+
+    @abstractmethod
+    def compute_operations(
+        self, adapter: Adapter[N], before: N, after: N
+    ) -> Sequence[Operation]:
+        raise NotImplementedError()
+
+
+Path = Tuple[int, ...]
+
+# Child indices on the way to the scoped paths. `None` marks the end of a path,
+# below which everything is in scope.
+_Scope = Dict[int, Optional["_Scope"]]
+
+
+class _Lazy(Tuple["Operation", ...]):
+    """Type of the `sub' of ``descend`` operations whose nested operations are
+    left for `TreeMatcher._walk' to resolve. Unlike the empty tuple, which
+    CPython shares, its instance is distinct from every other sequence."""
+
+
+_LAZY: Final[Sequence["Operation"]] = _Lazy()
+
+# Texts whose differing windows are larger than this (in characters on one
+# side times characters on the other) are not aligned character by character.
+_TEXT_BUDGET: Final[int] = 1_000_000
+
+
+class DiffStats(NamedTuple):
+    inserted: int
+    deleted: int
+    updated: int
+
+
 class TreeMatcher(Generic[N]):
     """Objects of this class are able to match trees. This is similar in
     spirit to `difflib.SequenceMatcher'"""
 
-    def __init__(self, adapter: Adapter[N], before: N, after: N):
-        self._adapter: Final[_ModeStack[N]] = _ModeStack(adapter)
+    def __init__(
+        self,
+        adapter: Adapter[N],
+        before: N,
+        after: N,
+        *,
+        similarity: Optional[float] = None,
+        similarity_budget: int = 10_000,
+        cache_size: int = 0,
+        scope: Optional[Iterable[Path]] = None,
+        engine: Optional[Engine[N]] = None,
+        shared: bool = False,
+    ):
+        self._adapter: Final[_ModeStack[N]] = _ModeStack(
+            adapter, shared=shared
+        )
         self._before: Final[N] = before
         self._after: Final[N] = after
         self.is_junk = None
 
+        # When set, nodes in a ``replace`` block whose children overlap by at
+        # least this (Dice) ratio are paired up and descended into instead of
+        # being replaced wholesale. Such `DESCEND' operations may pair nodes
+        # which are not shallow-equal, so `Apply.descend' should update the
+        # node itself from `after'.
+        self.similarity: Optional[float] = similarity
+
+        # Replace blocks with more candidate pairs than this are not searched
+        # for similar nodes, which keeps the pairing near-linear.
+        self.similarity_budget: int = similarity_budget
+
+        # Number of nested diffs remembered by the (before, after) digests of
+        # their parents, so that a subtree which changed identically in many
+        # places is only diffed once. Cached `sub' sequences are shared
+        # between operations. Zero disables the cache.
+        self.cache_size: int = cache_size
+        self._cache: Final[
+            OrderedDict[Tuple[int, int], Tuple[N, N, Sequence[Operation]]]
+        ] = OrderedDict()
+
+        # Set when nodes are shared between several parents, so that the
+        # trees are DAGs. Deep hashes, deep equality and nested diffs are then
+        # remembered by node identity for the lifetime of the matcher, and
+        # shared subtrees are visited once instead of once per path. Off by
+        # default, since the memos hold on to every visited node.
+        self.shared: Final[bool] = shared
+        self._resolved: Final[
+            Dict[Tuple[int, int], Tuple[N, N, Sequence[Operation]]]
+        ] = {}
+
+        # While set, nested diffs are left for `_walk' to resolve one level at
+        # a time instead of being built recursively.
+        self._lazy = False
+
+        # Computes the operations instead of the rstdiff-derived heuristic
+        # below. The other options only apply to the heuristic.
+        self.engine: Optional[Engine[N]] = engine
+
+        # When given, only the subtrees at these paths (which are the same in
+        # both trees) are diffed. Everything else is treated like an opaque
+        # node: it is matched shallowly, and shallow-equal nodes are reported
+        # as ``equal`` even if their descendants differ.
+        self._scope: Optional[_Scope] = None
+        if scope is not None:
+            self._scope = {}
+            for path in scope:
+                if not path:
+                    self._scope = None
+                    break
+                node = self._scope
+                for index in path[:-1]:
+                    child = node.setdefault(index, {})
+                    if child is None:
+                        break
+                    node = child
+                else:
+                    node[path[-1]] = None
+
     def compute_operations(self) -> Sequence[Operation]:
+        if self.engine is not None:
+            return self.engine.compute_operations(
+                self._adapter.adapter, self._before, self._after
+            )
+        return self._resolveRoot()
+
+    def are_equal(self) -> bool:
+        """Returns whether the trees are deeply equal, stopping at the first
+        difference without computing any operations. With a `scope`, only
+        differences that `compute_operations` would report count."""
+        if self._scope is None:
+            return self._adapter.deep.deep_equals(self._before, self._after)
+
+        # Differences outside of the scope don't count, so answer from the
+        # (scoped) operations, level by level.
+        adapter = self._adapter.adapter
+        for aNodes, bNodes, _, _, op in self._walk():
+            if op.tag == Tag.DESCEND:
+                if not adapter.shallow_equals(aNodes[op.i1], bNodes[op.j1]):
+                    return False
+            elif op.tag != Tag.EQUAL:
+                return False
+        return True
+
+    def changed_paths(self) -> Iterator[Tuple[Optional[Path], Optional[Path]]]:
+        """Yields the paths of changed nodes as ``(before, after)`` pairs,
+        where a path is the sequence of child indices leading to a node.
+        Deleted nodes have no `after' path and inserted nodes have no
+        `before' path.
+
+        The operation tree is never built, and only the windows left between
+        the common leading and trailing children of a level are aligned.
+        Unchanged subtrees are still visited once to tell that they are
+        unchanged (unless they are the same objects in both trees), so the
+        comparisons cost about as much as `compute_operations'."""
+        adapter = self._adapter.adapter
+        for aNodes, bNodes, aPath, bPath, op in self._walk():
+            # Paths from `_walk' start with the index of the root itself.
+            if op.tag == Tag.DESCEND:
+                if not adapter.shallow_equals(aNodes[op.i1], bNodes[op.j1]):
+                    yield ((aPath + (op.i1,))[1:], (bPath + (op.j1,))[1:])
+            elif op.tag != Tag.EQUAL:
+                for i in range(op.i1, op.i2):
+                    yield ((aPath + (i,))[1:], None)
+                for j in range(op.j1, op.j2):
+                    yield (None, (bPath + (j,))[1:])
+
+    def diff_stats(self) -> DiffStats:
+        """Counts the nodes at the top of each changed range without building
+        the operation tree. Descendants of those nodes are not counted. Costs
+        about as much as `changed_paths'."""
+        inserted = 0
+        deleted = 0
+        updated = 0
+        adapter = self._adapter.adapter
+        for aNodes, bNodes, _, _, op in self._walk():
+            if op.tag == Tag.DESCEND:
+                if not adapter.shallow_equals(aNodes[op.i1], bNodes[op.j1]):
+                    updated += 1
+            elif op.tag != Tag.EQUAL:
+                deleted += op.i2 - op.i1
+                inserted += op.j2 - op.j1
+        return DiffStats(inserted=inserted, deleted=deleted, updated=updated)
+
+    def _walk(
+        self,
+    ) -> Iterator[Tuple[Sequence[N], Sequence[N], Path, Path, Operation]]:
+        """Yields the operations of every level together with the nodes and
+        paths they pertain to, resolving one level at a time."""
+        stack: List[
+            Tuple[Sequence[N], Sequence[N], Path, Path, Sequence[Operation]]
+        ]
+        stack = [([self._before], [self._after], (), (), self._level(None))]
+        while stack:
+            aNodes, bNodes, aPath, bPath, ops = stack.pop()
+            for op in ops:
+                yield (aNodes, bNodes, aPath, bPath, op)
+
+            for op in reversed(ops):
+                if op.tag != Tag.DESCEND:
+                    continue
+                aElem = aNodes[op.i1]
+                bElem = bNodes[op.j1]
+
+                # Levels leading to scoped paths are resolved eagerly.
+                sub = op.sub
+                if sub is _LAZY:
+                    sub = self._level((aElem, bElem))
+                assert sub is not None
+
+                stack.append(
+                    (
+                        self._adapter.children(aElem),
+                        self._adapter.children(bElem),
+                        aPath + (op.i1,),
+                        bPath + (op.j1,),
+                        sub,
+                    )
+                )
+
+    def _level(self, pair: Optional[Tuple[N, N]]) -> Sequence[Operation]:
+        """Returns the operations for the children of `pair` (or for the roots
+        if `pair` is `None`) without resolving nested levels."""
+        self._lazy = True
+        try:
+            if pair is None:
+                return self._resolveRoot()
+            return self._resolveChildren(*pair)
+        finally:
+            self._lazy = False
+
+    def _resolveRoot(self) -> List[Operation]:
         with self._adapter.push(shallow=True):
             sm = SequenceMatcher(
                 self.is_junk,
@@ -247,6 +709,15 @@ class TreeMatcher(Generic[N]):
             )
             rootOpcodes = sm.get_opcodes()
             if rootOpcodes[0][0] == "equal":
+                sub: Sequence[Operation]
+                if self._scope is not None:
+                    sub = self._resolveScoped(
+                        self._before, self._after, self._scope
+                    )
+                elif self._lazy:
+                    sub = _LAZY
+                else:
+                    sub = self._resolveChildren(self._before, self._after)
                 return [
                     Operation(
                         tag=Tag.DESCEND,
@@ -254,36 +725,261 @@ class TreeMatcher(Generic[N]):
                         i2=1,
                         j1=0,
                         j2=1,
-                        sub=self._resolveRootEqual(self._before, self._after),
+                        sub=sub,
                     )
                 ]
+            elif self._scope is not None:
+                return [Operation.from_sequence_matcher(rootOpcodes[0])]
             else:
-                return [
-                    Operation.from_sequence_matcher(v) for v in rootOpcodes
-                ]
+                return self._resolveSimilar(
+                    [self._before], [self._after], 0, 1, 0, 1
+                )
+
+    def _resolveScoped(
+        self, aElem: N, bElem: N, scope: _Scope
+    ) -> List[Operation]:
+        """Descends into the children of `aElem` and `bElem` at the indices in
+        `scope`. Returns opcodes for the children, where children outside of
+        the scope are only matched shallowly."""
+        a = self._adapter.children(aElem)
+        b = self._adapter.children(bElem)
+        result: List[Operation] = []
+        done = 0
+        for index in sorted(scope):
+            if index >= len(a) or index >= len(b):
+                break
+
+            self._resolveOpaque(result, a, b, done, index, done, index)
 
-    def _resolveRootEqual(self, aElem: N, bElem: N) -> Sequence[Operation]:
+            if self._adapter.adapter.shallow_equals(a[index], b[index]):
+                child = scope[index]
+                sub: Sequence[Operation]
+                if child is not None:
+                    sub = self._resolveScoped(a[index], b[index], child)
+                elif self._lazy:
+                    sub = _LAZY
+                else:
+                    sub = self._resolveChildren(a[index], b[index])
+                op = Operation(
+                    tag=Tag.DESCEND,
+                    i1=index,
+                    i2=index + 1,
+                    j1=index,
+                    j2=index + 1,
+                    sub=sub,
+                )
+                result.append(op)
+            else:
+                _gap(result, index, index + 1, index, index + 1)
+            done = index + 1
+
+        self._resolveOpaque(result, a, b, done, len(a), done, len(b))
+        return result
+
+    def _resolveOpaque(
+        self,
+        result: List[Operation],
+        a: Sequence[N],
+        b: Sequence[N],
+        aBeg: int,
+        aEnd: int,
+        bBeg: int,
+        bEnd: int,
+    ) -> None:
+        """Appends opcodes matching `a[aBeg:aEnd]` with `b[bBeg:bEnd]` by
+        their shallow properties alone."""
+        if aBeg >= aEnd or bBeg >= bEnd:
+            _gap(result, aBeg, aEnd, bBeg, bEnd)
+            return
+
+        with self._adapter.push(shallow=True):
+            sm = SequenceMatcher(
+                self.is_junk,
+                self._adapter.wrap_all(a[aBeg:aEnd]),
+                self._adapter.wrap_all(b[bBeg:bEnd]),
+            )
+            for opcode, i1, i2, j1, j2 in sm.get_opcodes():
+                if opcode == "equal":
+                    _equal(result, aBeg + i1, bBeg + j1, i2 - i1)
+                else:
+                    _gap(result, aBeg + i1, aBeg + i2, bBeg + j1, bBeg + j2)
+
+    def _digests(
+        self, aWrap: _Wrap[N], bWrap: _Wrap[N]
+    ) -> Optional[Tuple[int, int]]:
+        if self.cache_size <= 0:
+            return None
+        return (hash(aWrap), hash(bWrap))
+
+    def _resolveChildren(
+        self,
+        aElem: N,
+        bElem: N,
+        digests: Optional[Tuple[int, int]] = None,
+    ) -> Sequence[Operation]:
         """Considers children of `aElem` and `bElem` which have equal roots.
-        Returns opcodes for the children."""
+        Returns opcodes for the children, possibly from the cache. `digests`
+        are the deep hashes of `aElem` and `bElem`, if already known."""
+        # Levels resolved for `_walk' hold placeholders, so they bypass the
+        # caches.
+        cached = self.cache_size > 0 and not self._lazy
+        shared = self.shared and not self._lazy
+
+        # Pairs of nodes shared by several parents are resolved once, and
+        # their operations are shared as well.
+        key = (id(aElem), id(bElem))
+        if shared:
+            resolved = self._resolved.get(key)
+            if resolved is not None:
+                return resolved[2]
+
+        if cached:
+            deep = self._adapter.deep
+            if digests is None:
+                digests = (deep.deep_hash(aElem), deep.deep_hash(bElem))
+
+            entry = self._cache.get(digests)
+            if (
+                entry is not None
+                and deep.deep_equals(entry[0], aElem)
+                and deep.deep_equals(entry[1], bElem)
+            ):
+                self._cache.move_to_end(digests)
+                if shared:
+                    self._resolved[key] = (aElem, bElem, entry[2])
+                return entry[2]
+
         with self._adapter.push(shallow=False):
             a_children = self._adapter.children(aElem)
             b_children = self._adapter.children(bElem)
-            a = self._adapter.wrap_all(a_children)
-            b = self._adapter.wrap_all(b_children)
-            sm = SequenceMatcher(self.is_junk, a, b)
-            nestedOpcodes = sm.get_opcodes()
-            return self._resolveDeepReplace(
-                nestedOpcodes, a_children, b_children
-            )
+
+            result: Optional[Sequence[Operation]] = None
+            if aElem is bElem:
+                identical: List[Operation] = []
+                if a_children:
+                    _equal(identical, 0, 0, len(a_children))
+                result = identical
+            else:
+                result = self._resolveKeyed(a_children, b_children)
+
+            if result is None:
+                a = self._adapter.wrap_all(a_children)
+                b = self._adapter.wrap_all(b_children)
+
+                # Only the window between the common leading and trailing
+                # runs goes through `SequenceMatcher`.
+                head, tail = _trim(a, b)
+                nestedOpcodes: List[Tuple[str, int, int, int, int]] = []
+                if head:
+                    nestedOpcodes.append(("equal", 0, head, 0, head))
+                if head < len(a) - tail or head < len(b) - tail:
+                    sm = SequenceMatcher(
+                        self.is_junk,
+                        a[head : len(a) - tail],
+                        b[head : len(b) - tail],
+                    )
+                    for opcode, i1, i2, j1, j2 in sm.get_opcodes():
+                        nestedOpcodes.append(
+                            (
+                                opcode,
+                                head + i1,
+                                head + i2,
+                                head + j1,
+                                head + j2,
+                            )
+                        )
+                if tail:
+                    nestedOpcodes.append(
+                        ("equal", len(a) - tail, len(a), len(b) - tail, len(b))
+                    )
+                result = self._resolveDeepReplace(
+                    nestedOpcodes, a_children, b_children, a, b
+                )
+
+        if cached:
+            assert digests is not None
+            self._cache[digests] = (aElem, bElem, result)
+            self._cache.move_to_end(digests)
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        if shared:
+            self._resolved[key] = (aElem, bElem, result)
+        return result
+
+    def _resolveKeyed(
+        self, a: Sequence[N], b: Sequence[N]
+    ) -> Optional[List[Operation]]:
+        """Aligns `a` and `b` by the keys of their nodes in linear time.
+        Returns `None` if some node has no key, or if keys are repeated."""
+        adapter = self._adapter.adapter
+        if not a or not b or adapter.key(a[0]) is None:
+            return None
+
+        b_index: Dict[Hashable, int] = {}
+        for bIdx, node in enumerate(b):
+            key = adapter.key(node)
+            if key is None or key in b_index:
+                return None
+            b_index[key] = bIdx
+
+        seen = set()
+        pairs = []
+        for aIdx, node in enumerate(a):
+            key = adapter.key(node)
+            if key is None or key in seen:
+                return None
+            seen.add(key)
+            bIdx = b_index.get(key, -1)
+            if bIdx >= 0:
+                pairs.append((aIdx, bIdx))
+
+        # Keyed nodes that moved relative to the others are deleted and
+        # inserted again, since operations cannot express moves.
+        result: List[Operation] = []
+        aDone = 0
+        bDone = 0
+        for aIdx, bIdx in _increasing(pairs):
+            _gap(result, aDone, aIdx, bDone, bIdx)
+            aWrap = self._adapter.wrap(a[aIdx])
+            bWrap = self._adapter.wrap(b[bIdx])
+            if aWrap == bWrap:
+                _equal(result, aIdx, bIdx, 1)
+            elif adapter.shallow_equals(a[aIdx], b[bIdx]):
+                sub = _LAZY
+                if not self._lazy:
+                    sub = self._resolveChildren(
+                        a[aIdx], b[bIdx], self._digests(aWrap, bWrap)
+                    )
+                result.append(
+                    Operation(
+                        tag=Tag.DESCEND,
+                        i1=aIdx,
+                        i2=aIdx + 1,
+                        j1=bIdx,
+                        j2=bIdx + 1,
+                        sub=sub,
+                    )
+                )
+            else:
+                result.extend(
+                    self._resolveSimilar(a, b, aIdx, aIdx + 1, bIdx, bIdx + 1)
+                )
+            aDone = aIdx + 1
+            bDone = bIdx + 1
+        _gap(result, aDone, len(a), bDone, len(b))
+        return result
 
     def _resolveDeepReplace(
         self,
         opcodes: Sequence[Tuple[str, int, int, int, int]],
         a: Sequence[N],
         b: Sequence[N],
+        a_deep: Sequence[_Wrap[N]],
+        b_deep: Sequence[_Wrap[N]],
     ) -> Sequence[Operation]:
         """Resolves ``replace`` elements in `opcodes` pertaining to `a` and
-        `b`. Returns opcodes including nested elements for these cases."""
+        `b`. Returns opcodes including nested elements for these cases.
+        `a_deep` and `b_deep` are the deep wrappers of `a` and `b`."""
         result = []
         for i in range(len(opcodes)):
             (opcode, aBeg, aEnd, bBeg, bEnd) = opcodes[i]
@@ -303,7 +999,18 @@ class TreeMatcher(Generic[N]):
                         bSubBeg,
                         bSubEnd,
                     ) = rootOpcodes[j]
-                    if subOpcode != "equal":
+                    if subOpcode == "replace":
+                        result.extend(
+                            self._resolveSimilar(
+                                a,
+                                b,
+                                aBeg + aSubBeg,
+                                aBeg + aSubEnd,
+                                bBeg + bSubBeg,
+                                bBeg + bSubEnd,
+                            )
+                        )
+                    elif subOpcode != "equal":
                         result.append(
                             Operation(
                                 tag=Tag.from_str(subOpcode),
@@ -318,6 +1025,13 @@ class TreeMatcher(Generic[N]):
                         for k in range(aSubEnd - aSubBeg):
                             aIdx = aBeg + aSubBeg + k
                             bIdx = bBeg + bSubBeg + k
+                            sub = _LAZY
+                            if not self._lazy:
+                                sub = self._resolveChildren(
+                                    a[aIdx],
+                                    b[bIdx],
+                                    self._digests(a_deep[aIdx], b_deep[bIdx]),
+                                )
                             result.append(
                                 Operation(
                                     tag=Tag.DESCEND,
@@ -325,9 +1039,190 @@ class TreeMatcher(Generic[N]):
                                     i2=aIdx + 1,
                                     j1=bIdx,
                                     j2=bIdx + 1,
-                                    sub=self._resolveRootEqual(
-                                        a[aIdx], b[bIdx]
-                                    ),
+                                    sub=sub,
                                 )
                             )
         return result
+
+    def _replace(
+        self,
+        result: List[Operation],
+        a: Sequence[N],
+        b: Sequence[N],
+        aBeg: int,
+        aEnd: int,
+        bBeg: int,
+        bEnd: int,
+    ) -> None:
+        """Appends opcodes replacing `a[aBeg:aEnd]` with `b[bBeg:bEnd]`.
+        Text-bearing leaves replaced one for one get the character-level
+        operations transforming their text as `sub`."""
+        if aEnd - aBeg != bEnd - bBeg:
+            _gap(result, aBeg, aEnd, bBeg, bEnd)
+            return
+
+        adapter = self._adapter.adapter
+        plain = 0
+        for offset in range(aEnd - aBeg):
+            aNode = a[aBeg + offset]
+            bNode = b[bBeg + offset]
+            sub = None
+            if not self._adapter.children(aNode):
+                if not self._adapter.children(bNode):
+                    sub = self._resolveText(
+                        adapter.text(aNode), adapter.text(bNode)
+                    )
+
+            if sub is None:
+                continue
+
+            _gap(
+                result,
+                aBeg + plain,
+                aBeg + offset,
+                bBeg + plain,
+                bBeg + offset,
+            )
+            result.append(
+                Operation(
+                    tag=Tag.REPLACE,
+                    i1=aBeg + offset,
+                    i2=aBeg + offset + 1,
+                    j1=bBeg + offset,
+                    j2=bBeg + offset + 1,
+                    sub=sub,
+                )
+            )
+            plain = offset + 1
+
+        _gap(result, aBeg + plain, aEnd, bBeg + plain, bEnd)
+
+    def _resolveText(
+        self, aText: Optional[str], bText: Optional[str]
+    ) -> Optional[List[Operation]]:
+        if aText is None or bText is None:
+            return None
+
+        limit = min(len(aText), len(bText))
+        head = 0
+        while head < limit and aText[head] == bText[head]:
+            head += 1
+
+        tail = 0
+        while tail < limit - head and aText[-1 - tail] == bText[-1 - tail]:
+            tail += 1
+
+        aEnd = len(aText) - tail
+        bEnd = len(bText) - tail
+        result: List[Operation] = []
+        if head:
+            _equal(result, 0, 0, head)
+
+        # Only the window between the common prefix and suffix is aligned.
+        # `autojunk' would disregard every frequent character of long texts,
+        # and without it alignment is quadratic, so large windows are
+        # replaced as a whole.
+        if (aEnd - head) * (bEnd - head) > _TEXT_BUDGET:
+            _gap(result, head, aEnd, head, bEnd)
+        else:
+            sm = SequenceMatcher(
+                None, aText[head:aEnd], bText[head:bEnd], autojunk=False
+            )
+            for opcode, i1, i2, j1, j2 in sm.get_opcodes():
+                if opcode == "equal":
+                    _equal(result, head + i1, head + j1, i2 - i1)
+                else:
+                    _gap(result, head + i1, head + i2, head + j1, head + j2)
+
+        if tail:
+            _equal(result, aEnd, bEnd, tail)
+
+        if not any(op.tag == Tag.EQUAL for op in result):
+            return None
+        return result
+
+    def _resolveSimilar(
+        self,
+        a: Sequence[N],
+        b: Sequence[N],
+        aBeg: int,
+        aEnd: int,
+        bBeg: int,
+        bEnd: int,
+    ) -> List[Operation]:
+        """Pairs nodes of the replaced ranges `a[aBeg:aEnd]` and
+        `b[bBeg:bEnd]` by the overlap of their children's digests. Returns
+        ``descend`` operations for paired nodes, and plain operations for the
+        rest."""
+        result: List[Operation] = []
+        threshold = self.similarity
+        if (
+            threshold is None
+            or (aEnd - aBeg) * (bEnd - bBeg) > self.similarity_budget
+        ):
+            self._replace(result, a, b, aBeg, aEnd, bBeg, bEnd)
+            return result
+
+        deep = self._adapter.deep
+        children = self._adapter.children
+        lefts = [
+            Counter(deep.deep_hash(c) for c in children(n))
+            for n in a[aBeg:aEnd]
+        ]
+        rights = [
+            Counter(deep.deep_hash(c) for c in children(n))
+            for n in b[bBeg:bEnd]
+        ]
+
+        def score(x: int, y: int) -> float:
+            total = lefts[x].total() + rights[y].total()
+            if not total:
+                return 0.0
+            overlap = (lefts[x] & rights[y]).total()
+            return 2.0 * overlap / total
+
+        # Heaviest order-preserving pairing of sufficiently similar nodes.
+        best = [[0.0] * (len(rights) + 1) for _ in range(len(lefts) + 1)]
+        for x in range(len(lefts)):
+            for y in range(len(rights)):
+                value = max(best[x][y + 1], best[x + 1][y])
+                ratio = score(x, y)
+                if ratio >= threshold:
+                    value = max(value, best[x][y] + ratio)
+                best[x + 1][y + 1] = value
+
+        pairs = []
+        x = len(lefts)
+        y = len(rights)
+        while x and y:
+            if best[x][y] == best[x - 1][y]:
+                x -= 1
+            elif best[x][y] == best[x][y - 1]:
+                y -= 1
+            else:
+                x -= 1
+                y -= 1
+                pairs.append((aBeg + x, bBeg + y))
+        pairs.reverse()
+
+        aIdx = aBeg
+        bIdx = bBeg
+        for aPair, bPair in pairs:
+            self._replace(result, a, b, aIdx, aPair, bIdx, bPair)
+            sub = _LAZY
+            if not self._lazy:
+                sub = self._resolveChildren(a[aPair], b[bPair])
+            result.append(
+                Operation(
+                    tag=Tag.DESCEND,
+                    i1=aPair,
+                    i2=aPair + 1,
+                    j1=bPair,
+                    j2=bPair + 1,
+                    sub=sub,
+                )
+            )
+            aIdx = aPair + 1
+            bIdx = bPair + 1
+        self._replace(result, a, b, aIdx, aEnd, bIdx, bEnd)
+        return result
@@ -0,0 +1,59 @@
+# Copyright 2023 Sam Wilson
+#
+# fladrif is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published
+# by the Free Software Foundation; either version 2 of the License,
+# or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA
+# 02111-1307, USA.
+
+from typing import Final, List, Sequence
+
+from helpers.tree import MockAdapter, MockNode
+
+from fladrif.apply import Apply
+
+
+class Rebuild(Apply[MockNode]):
+    """Reconstructs the `after` tree using only nodes taken from the places
+    the operations point at."""
+
+    stack: Final[List[List[MockNode]]]
+
+    def __init__(self, before: MockNode, after: MockNode) -> None:
+        super().__init__(MockAdapter(), before, after)
+        self.stack = [[]]
+
+    def replace(
+        self, before: Sequence[MockNode], after: Sequence[MockNode]
+    ) -> None:
+        self.stack[-1].extend(after)
+
+    def insert(self, after: Sequence[MockNode]) -> None:
+        self.stack[-1].extend(after)
+
+    def equal(
+        self, before: Sequence[MockNode], after: Sequence[MockNode]
+    ) -> None:
+        self.stack[-1].extend(before)
+
+    def descend(self, before: MockNode, after: MockNode) -> None:
+        node = MockNode(after.internal)
+        self.stack[-1].append(node)
+        self.stack.append(node.children)
+
+    def ascend(self) -> None:
+        self.stack.pop()
+
+    def output(self) -> MockNode:
+        assert 1 == len(self.stack)
+        assert 1 == len(self.stack[0])
+        return self.stack[0][0]
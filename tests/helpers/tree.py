@@ -16,7 +16,7 @@
 # 02111-1307, USA.
 
 from dataclasses import dataclass, field
-from typing import List
+from typing import Hashable, List, Optional
 
 from fladrif.treediff import Adapter
 
@@ -25,6 +25,8 @@ from fladrif.treediff import Adapter
 class MockNode:
     internal: int
     children: List["MockNode"] = field(default_factory=list)
+    key: Optional[int] = None
+    text: Optional[str] = None
 
     def add(self, child: "MockNode") -> "MockNode":
         self.children.append(child)
@@ -40,3 +42,19 @@ class MockAdapter(Adapter[MockNode]):
 
     def children(self, node: MockNode) -> List[MockNode]:
         return node.children
+
+
+class KeyedAdapter(MockAdapter):
+    def key(self, node: MockNode) -> Optional[Hashable]:
+        return node.key
+
+
+class TextAdapter(MockAdapter):
+    def shallow_equals(self, lhs: MockNode, rhs: MockNode) -> bool:
+        return lhs.internal == rhs.internal and lhs.text == rhs.text
+
+    def shallow_hash(self, node: MockNode) -> int:
+        return hash((node.internal, node.text))
+
+    def text(self, node: MockNode) -> Optional[str]:
+        return node.text
@@ -15,15 +15,18 @@
 # Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA
 # 02111-1307, USA.
 
+import asyncio
 from dataclasses import dataclass, field
-from typing import Final, Iterable, List, Sequence, TypeAlias, Union
+from typing import Final, Iterable, List, Sequence, Tuple, TypeAlias, Union
 
+import pytest
 from helpers.tree import MockAdapter
 from helpers.tree import MockNode as N
+from helpers.tree import TextAdapter
 
 from fladrif import apply
 from fladrif.treediff import Operation as Op
-from fladrif.treediff import TreeMatcher
+from fladrif.treediff import Tag, TreeMatcher
 
 
 @dataclass
@@ -274,3 +277,232 @@ def test_structure() -> None:
     assert isinstance(child.after[0], (SameNode, N))
     assert 3 == child.after[0].internal
     assert not child.after[0].children
+
+
+def test_edit_text_falls_back_to_replace() -> None:
+    before = N(1, text="abc")
+    after = N(1, text="abd")
+    operations = TreeMatcher(TextAdapter(), before, after).compute_operations()
+    assert operations[0].sub is not None
+
+    applier = Apply(before, after)
+    applier.apply(operations)
+
+    actual = applier.output()
+    assert isinstance(actual, DiffNode)
+    assert actual.before == [before]
+    assert actual.after == [after]
+
+
+class EditText(Apply):
+    edits: List[Tuple[str, Sequence[Op]]]
+
+    def __init__(self, before: N, after: N) -> None:
+        super().__init__(before, after)
+        self.edits = []
+
+    def edit_text(self, before: N, after: N, operations: Sequence[Op]) -> None:
+        assert after.text is not None
+        self.edits.append((after.text, operations))
+
+
+def test_edit_text() -> None:
+    before = N(1).add(N(2, text="abc"))
+    after = N(1).add(N(2, text="abd"))
+    operations = TreeMatcher(TextAdapter(), before, after).compute_operations()
+
+    applier = EditText(before, after)
+    applier.apply(operations)
+
+    assert applier.edits == [
+        (
+            "abd",
+            [
+                Op(Tag.EQUAL, 0, 2, 0, 2, sub=None),
+                Op(Tag.REPLACE, 2, 3, 2, 3, sub=None),
+            ],
+        )
+    ]
+
+
+class Record(apply.Apply[N]):
+    calls: Final[List[Tuple[str, int]]]
+
+    def __init__(self, before: N, after: N) -> None:
+        super().__init__(MockAdapter(), before, after)
+        self.calls = []
+
+    def replace(self, before: Sequence[N], after: Sequence[N]) -> None:
+        self.calls.append(("replace", len(after)))
+
+    def delete(self, before: Sequence[N]) -> None:
+        self.calls.append(("delete", len(before)))
+
+    def insert(self, after: Sequence[N]) -> None:
+        self.calls.append(("insert", len(after)))
+
+    def equal(self, before: Sequence[N], after: Sequence[N]) -> None:
+        self.calls.append(("equal", len(after)))
+
+    def descend(self, before: N, after: N) -> None:
+        self.calls.append(("descend", after.internal))
+
+    def ascend(self) -> None:
+        self.calls.append(("ascend", 0))
+
+
+class AsyncRecord(apply.AsyncApply[N]):
+    calls: Final[List[Tuple[str, int]]]
+    batches: Final[List[int]]
+
+    def __init__(
+        self,
+        before: N,
+        after: N,
+        latencies: Sequence[float] = (0.0,),
+        **kwargs: int,
+    ) -> None:
+        super().__init__(MockAdapter(), before, after, **kwargs)
+        self.calls = []
+        self.batches = []
+        self.running = 0
+        self.peak = 0
+        self.latencies = latencies
+        self.started = 0
+
+    async def deliver(self, calls: Sequence[apply.Call]) -> None:
+        self.batches.append(len(calls))
+        self.running += 1
+        self.peak = max(self.peak, self.running)
+        try:
+            await asyncio.sleep(0)
+            await super().deliver(calls)
+        finally:
+            self.running -= 1
+
+    async def record(self, call: Tuple[str, int]) -> None:
+        self.started += 1
+        await asyncio.sleep(self.latencies[self.started % len(self.latencies)])
+        self.calls.append(call)
+
+    async def replace(self, before: Sequence[N], after: Sequence[N]) -> None:
+        await self.record(("replace", len(after)))
+
+    async def delete(self, before: Sequence[N]) -> None:
+        await self.record(("delete", len(before)))
+
+    async def insert(self, after: Sequence[N]) -> None:
+        await self.record(("insert", len(after)))
+
+    async def equal(self, before: Sequence[N], after: Sequence[N]) -> None:
+        await self.record(("equal", len(after)))
+
+    async def descend(self, before: N, after: N) -> None:
+        await self.record(("descend", after.internal))
+
+    async def ascend(self) -> None:
+        await self.record(("ascend", 0))
+
+
+def test_async_apply_matches_apply() -> None:
+    before = N(1).add(N(2).add(N(3))).add(N(4)).add(N(5))
+    after = N(1).add(N(2)).add(N(3)).add(N(4)).add(N(6))
+    operations = TreeMatcher(MockAdapter(), before, after).compute_operations()
+
+    expected = Record(before, after)
+    expected.apply(operations)
+
+    actual = AsyncRecord(before, after, batch_size=3)
+    asyncio.run(actual.apply(operations))
+
+    assert actual.calls == expected.calls
+    assert actual.batches == [3, 3, 2]
+    assert actual.peak == 1
+
+
+def test_async_apply_in_flight() -> None:
+    before = N(1).add(N(2).add(N(3))).add(N(4)).add(N(5))
+    after = N(1).add(N(2)).add(N(3)).add(N(4)).add(N(6))
+    operations = TreeMatcher(MockAdapter(), before, after).compute_operations()
+
+    actual = AsyncRecord(before, after, batch_size=1, max_in_flight=2)
+    asyncio.run(actual.apply(operations))
+
+    assert actual.batches == [1] * 8
+    assert actual.peak == 2
+
+
+def test_async_apply_in_flight_order() -> None:
+    before = N(1).add(N(2).add(N(3))).add(N(4)).add(N(5))
+    after = N(1).add(N(2)).add(N(3)).add(N(4)).add(N(6))
+    operations = TreeMatcher(MockAdapter(), before, after).compute_operations()
+
+    expected = Record(before, after)
+    expected.apply(operations)
+
+    actual = AsyncRecord(
+        before, after, latencies=(0.02, 0.0), batch_size=1, max_in_flight=2
+    )
+    asyncio.run(actual.apply(operations))
+
+    assert actual.calls == expected.calls
+    assert actual.peak == 2
+
+
+class Failing(apply.AsyncApply[N]):
+    async def insert(self, after: Sequence[N]) -> None:
+        raise RuntimeError("insert")
+
+
+def test_async_apply_error() -> None:
+    before = N(1)
+    after = N(1).add(N(2))
+    operations = TreeMatcher(MockAdapter(), before, after).compute_operations()
+
+    applier = Failing(MockAdapter(), before, after, max_in_flight=4)
+    with pytest.raises(RuntimeError):
+        asyncio.run(applier.apply(operations))
+
+
+class FailingSecond(apply.AsyncApply[N]):
+    log: Final[List[str]]
+
+    def __init__(self, before: N, after: N) -> None:
+        super().__init__(
+            MockAdapter(), before, after, batch_size=1, max_in_flight=2
+        )
+        self.log = []
+
+    async def replace(self, before: Sequence[N], after: Sequence[N]) -> None:
+        count = len(self.log) + 1
+        self.log.append(f"send{count}")
+        await asyncio.sleep(0)
+        if count == 2:
+            raise RuntimeError("replace")
+
+
+def test_async_apply_stops_after_error() -> None:
+    before = N(1)
+    after = N(1)
+    for index in range(8):
+        before.add(N(10 + index))
+        after.add(N(20 + index))
+
+    operations = [
+        Op(
+            Tag.DESCEND,
+            0,
+            1,
+            0,
+            1,
+            sub=[
+                Op(Tag.REPLACE, i, i + 1, i, i + 1, sub=None) for i in range(8)
+            ],
+        )
+    ]
+
+    applier = FailingSecond(before, after)
+    with pytest.raises(RuntimeError):
+        asyncio.run(applier.apply(operations))
+
+    assert applier.log == ["send1", "send2"]
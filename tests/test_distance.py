@@ -0,0 +1,130 @@
+# Copyright 2023 Sam Wilson
+#
+# fladrif is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published
+# by the Free Software Foundation; either version 2 of the License,
+# or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA
+# 02111-1307, USA.
+
+from helpers.rebuild import Rebuild
+from helpers.tree import MockAdapter
+from helpers.tree import MockNode as N
+
+from fladrif.distance import EditDistance
+from fladrif.treediff import Operation as Op
+from fladrif.treediff import Tag, TreeMatcher
+
+
+def test_same() -> None:
+    before = N(1).add(N(2).add(N(3)))
+    adapter = MockAdapter()
+    matcher = TreeMatcher(adapter, before, before, engine=EditDistance[N]())
+
+    assert matcher.compute_operations() == [
+        Op(
+            Tag.DESCEND,
+            0,
+            1,
+            0,
+            1,
+            sub=[Op(Tag.EQUAL, 0, 1, 0, 1, sub=None)],
+        )
+    ]
+
+
+def test_minimal() -> None:
+    before = N(1).add(N(2).add(N(5)).add(N(6)).add(N(7))).add(N(3))
+    after = N(1).add(N(3)).add(N(2).add(N(5)).add(N(6)).add(N(7)).add(N(8)))
+    adapter = MockAdapter()
+    matcher = TreeMatcher(adapter, before, after, engine=EditDistance[N]())
+    actual = matcher.compute_operations()
+
+    assert actual == [
+        Op(
+            Tag.DESCEND,
+            0,
+            1,
+            0,
+            1,
+            sub=[
+                Op(Tag.INSERT, 0, 0, 0, 1, sub=None),
+                Op(
+                    Tag.DESCEND,
+                    0,
+                    1,
+                    1,
+                    2,
+                    sub=[
+                        Op(Tag.EQUAL, 0, 3, 0, 3, sub=None),
+                        Op(Tag.INSERT, 3, 3, 3, 4, sub=None),
+                    ],
+                ),
+                Op(Tag.DELETE, 1, 2, 2, 2, sub=None),
+            ],
+        )
+    ]
+
+    applier = Rebuild(before, after)
+    applier.apply(actual)
+    assert applier.output() == after
+
+
+def test_rename() -> None:
+    before = N(1).add(N(2).add(N(3)).add(N(4)))
+    after = N(1).add(N(5).add(N(3)).add(N(4)))
+    adapter = MockAdapter()
+
+    matcher = TreeMatcher(adapter, before, after, engine=EditDistance[N]())
+    assert matcher.compute_operations() == [
+        Op(
+            Tag.DESCEND,
+            0,
+            1,
+            0,
+            1,
+            sub=[
+                Op(
+                    Tag.DESCEND,
+                    0,
+                    1,
+                    0,
+                    1,
+                    sub=[Op(Tag.EQUAL, 0, 2, 0, 2, sub=None)],
+                ),
+            ],
+        )
+    ]
+
+    engine = EditDistance[N](rename_cost=10)
+    matcher = TreeMatcher(adapter, before, after, engine=engine)
+    assert matcher.compute_operations() == [
+        Op(
+            Tag.DESCEND,
+            0,
+            1,
+            0,
+            1,
+            sub=[Op(Tag.REPLACE, 0, 1, 0, 1, sub=None)],
+        )
+    ]
+
+
+def test_replace_root() -> None:
+    before = N(1).add(N(2))
+    after = N(3).add(N(4))
+    adapter = MockAdapter()
+    engine = EditDistance[N](rename_cost=5)
+    matcher = TreeMatcher(adapter, before, after, engine=engine)
+
+    assert matcher.compute_operations() == [
+        Op(Tag.REPLACE, 0, 1, 0, 1, sub=None)
+    ]
@@ -0,0 +1,95 @@
+# Copyright 2023 Sam Wilson
+#
+# fladrif is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published
+# by the Free Software Foundation; either version 2 of the License,
+# or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA
+# 02111-1307, USA.
+
+from helpers.tree import MockAdapter
+from helpers.tree import MockNode as N
+from helpers.tree import TextAdapter
+
+from fladrif.distance import EditDistance
+from fladrif.flat import FlatAdapter, FlatTree
+from fladrif.gumtree import GumTree
+from fladrif.treediff import TreeMatcher
+
+
+def test_columns() -> None:
+    root = N(1).add(N(2).add(N(3)).add(N(4))).add(N(5))
+    tree = FlatTree(MockAdapter(), root)
+
+    assert [n.internal for n in tree.nodes] == [1, 2, 3, 4, 5]
+    assert tree.roots == [0]
+    assert list(tree.parent) == [-1, 0, 1, 1, 0]
+    assert list(tree.size) == [5, 3, 1, 1, 1]
+    assert list(tree.first_child) == [1, 2, -1, -1, -1]
+    assert tree.children(0) == [1, 4]
+    assert tree.children(1) == [2, 3]
+    assert tree.children(4) == []
+
+
+def test_digests() -> None:
+    lhs = N(1).add(N(2).add(N(3)))
+    rhs = N(1).add(N(2).add(N(3)))
+    other = N(1).add(N(2)).add(N(3))
+    tree = FlatTree(MockAdapter(), lhs, rhs, other)
+    adapter = FlatAdapter(tree)
+    a, b, c = tree.roots
+
+    assert tree.digest[a] == tree.digest[b]
+    assert tree.digest[a] != tree.digest[c]
+    assert adapter.deep_equals(a, b)
+    assert not adapter.deep_equals(a, c)
+
+
+def test_matcher() -> None:
+    before = N(1).add(N(2).add(N(3))).add(N(4)).add(N(6).add(N(7)))
+    after = N(1).add(N(2)).add(N(3)).add(N(4)).add(N(6).add(N(8)))
+    expected = TreeMatcher(MockAdapter(), before, after).compute_operations()
+
+    tree = FlatTree(MockAdapter(), before, after)
+    matcher = TreeMatcher(FlatAdapter(tree), *tree.roots)
+
+    assert matcher.compute_operations() == expected
+
+
+def test_matcher_text() -> None:
+    before = N(1).add(N(2, text="hello world")).add(N(3, text="abc"))
+    after = N(1).add(N(2, text="hello there world")).add(N(3, text="xyz"))
+    expected = TreeMatcher(TextAdapter(), before, after).compute_operations()
+
+    tree = FlatTree(TextAdapter(), before, after)
+    matcher = TreeMatcher(FlatAdapter(tree), *tree.roots)
+
+    assert matcher.compute_operations() == expected
+
+
+class WideHashAdapter(MockAdapter):
+    def shallow_hash(self, node: N) -> int:
+        return node.internal * 2**64 + 1
+
+
+def test_wide_hashes() -> None:
+    before = N(1).add(N(2).add(N(3))).add(N(4))
+    after = N(1).add(N(2).add(N(5))).add(N(4))
+    adapter = WideHashAdapter()
+    expected = TreeMatcher(adapter, before, after).compute_operations()
+
+    tree = FlatTree(adapter, before, after)
+    matcher = TreeMatcher(FlatAdapter(tree), *tree.roots)
+
+    assert matcher.compute_operations() == expected
+    for engine in (EditDistance[N](), GumTree[N]()):
+        nodes = TreeMatcher(adapter, before, after, engine=engine)
+        assert nodes.compute_operations()
@@ -0,0 +1,123 @@
+# Copyright 2023 Sam Wilson
+#
+# fladrif is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published
+# by the Free Software Foundation; either version 2 of the License,
+# or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA
+# 02111-1307, USA.
+
+from helpers.rebuild import Rebuild
+from helpers.tree import MockAdapter
+from helpers.tree import MockNode as N
+
+from fladrif.gumtree import GumTree
+from fladrif.treediff import Operation as Op
+from fladrif.treediff import Tag, TreeMatcher
+
+
+def test_same() -> None:
+    before = N(1).add(N(2).add(N(3)))
+    after = N(1).add(N(2).add(N(3)))
+    adapter = MockAdapter()
+    matcher = TreeMatcher(adapter, before, after, engine=GumTree[N]())
+
+    assert matcher.compute_operations() == [
+        Op(
+            Tag.DESCEND,
+            0,
+            1,
+            0,
+            1,
+            sub=[Op(Tag.EQUAL, 0, 1, 0, 1, sub=None)],
+        )
+    ]
+
+
+def test_different_root() -> None:
+    adapter = MockAdapter()
+    matcher = TreeMatcher(adapter, N(1), N(2), engine=GumTree[N]())
+
+    assert matcher.compute_operations() == [
+        Op(Tag.REPLACE, 0, 1, 0, 1, sub=None)
+    ]
+
+
+def test_container() -> None:
+    before = N(1).add(N(9)).add(N(2).add(N(3)).add(N(4)).add(N(5)))
+    after = N(1).add(N(2).add(N(3)).add(N(4)).add(N(6)))
+    adapter = MockAdapter()
+    matcher = TreeMatcher(adapter, before, after, engine=GumTree[N]())
+    actual = matcher.compute_operations()
+
+    assert actual == [
+        Op(
+            Tag.DESCEND,
+            0,
+            1,
+            0,
+            1,
+            sub=[
+                Op(Tag.DELETE, 0, 1, 0, 0, sub=None),
+                Op(
+                    Tag.DESCEND,
+                    1,
+                    2,
+                    0,
+                    1,
+                    sub=[
+                        Op(Tag.EQUAL, 0, 2, 0, 2, sub=None),
+                        Op(Tag.REPLACE, 2, 3, 2, 3, sub=None),
+                    ],
+                ),
+            ],
+        )
+    ]
+
+
+def test_min_dice() -> None:
+    before = N(1).add(N(2).add(N(3)).add(N(4)).add(N(5)))
+    after = N(1).add(N(2).add(N(3)).add(N(6)).add(N(7)))
+    adapter = MockAdapter()
+    engine = GumTree[N](min_dice=0.5)
+    matcher = TreeMatcher(adapter, before, after, engine=engine)
+
+    assert matcher.compute_operations() == [
+        Op(
+            Tag.DESCEND,
+            0,
+            1,
+            0,
+            1,
+            sub=[Op(Tag.REPLACE, 0, 1, 0, 1, sub=None)],
+        )
+    ]
+
+
+def test_moves() -> None:
+    before = (
+        N(1)
+        .add(N(2).add(N(3)).add(N(4)))
+        .add(N(5).add(N(6)).add(N(7)))
+        .add(N(8).add(N(9).add(N(10))))
+    )
+    after = (
+        N(1)
+        .add(N(5).add(N(6)).add(N(7)))
+        .add(N(2).add(N(3)).add(N(4)).add(N(11)))
+        .add(N(12).add(N(8).add(N(9).add(N(10)))))
+    )
+    adapter = MockAdapter()
+    matcher = TreeMatcher(adapter, before, after, engine=GumTree[N]())
+
+    applier = Rebuild(before, after)
+    applier.apply(matcher.compute_operations())
+    assert applier.output() == after
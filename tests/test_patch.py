@@ -0,0 +1,141 @@
+# Copyright 2023 Sam Wilson
+#
+# fladrif is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published
+# by the Free Software Foundation; either version 2 of the License,
+# or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA
+# 02111-1307, USA.
+
+from typing import Sequence
+
+import pytest
+from helpers.rebuild import Rebuild
+from helpers.tree import MockAdapter
+from helpers.tree import MockNode as N
+
+from fladrif.patch import compose, invert
+from fladrif.treediff import Operation as Op
+from fladrif.treediff import Tag, TreeMatcher
+
+
+def diff(before: N, after: N) -> Sequence[Op]:
+    return TreeMatcher(MockAdapter(), before, after).compute_operations()
+
+
+def rebuild(before: N, after: N, operations: Sequence[Op]) -> N:
+    applier = Rebuild(before, after)
+    applier.apply(operations)
+    return applier.output()
+
+
+def versions() -> Sequence[N]:
+    return [
+        N(1).add(N(2).add(N(3))).add(N(4)),
+        N(1).add(N(2).add(N(3)).add(N(5))).add(N(4)).add(N(6)),
+        N(1).add(N(7)).add(N(2).add(N(5))).add(N(4)).add(N(6)),
+        N(1).add(N(4)).add(N(6).add(N(8))),
+        N(9).add(N(4)),
+    ]
+
+
+def test_invert_swaps_insert_and_delete() -> None:
+    operations = [
+        Op(
+            Tag.DESCEND,
+            0,
+            1,
+            0,
+            1,
+            sub=[
+                Op(Tag.EQUAL, 0, 1, 0, 1, sub=None),
+                Op(Tag.DELETE, 1, 3, 1, 1, sub=None),
+                Op(Tag.INSERT, 3, 3, 1, 2, sub=None),
+            ],
+        )
+    ]
+
+    assert invert(operations) == [
+        Op(
+            Tag.DESCEND,
+            0,
+            1,
+            0,
+            1,
+            sub=[
+                Op(Tag.EQUAL, 0, 1, 0, 1, sub=None),
+                Op(Tag.INSERT, 1, 1, 1, 3, sub=None),
+                Op(Tag.DELETE, 1, 2, 3, 3, sub=None),
+            ],
+        )
+    ]
+
+
+def test_invert_rebuilds_before() -> None:
+    trees = versions()
+    for before, after in zip(trees, trees[1:]):
+        operations = invert(diff(before, after))
+        assert rebuild(after, before, operations) == before
+
+
+def test_invert_is_involution() -> None:
+    trees = versions()
+    operations = diff(trees[0], trees[2])
+    assert invert(invert(operations)) == operations
+
+
+def test_compose_identity() -> None:
+    trees = versions()
+    operations = diff(trees[0], trees[1])
+    same = diff(trees[1], trees[1])
+    assert compose(operations, same) == operations
+
+
+def test_compose_merges_equal_runs() -> None:
+    first = [Op(Tag.EQUAL, 0, 2, 0, 2, sub=None)]
+    second = [
+        Op(Tag.EQUAL, 0, 1, 0, 1, sub=None),
+        Op(Tag.EQUAL, 1, 2, 1, 2, sub=None),
+    ]
+    assert compose(first, second) == [Op(Tag.EQUAL, 0, 2, 0, 2, sub=None)]
+
+
+def test_compose_insert_then_delete() -> None:
+    first = [
+        Op(Tag.EQUAL, 0, 1, 0, 1, sub=None),
+        Op(Tag.INSERT, 1, 1, 1, 3, sub=None),
+    ]
+    second = [
+        Op(Tag.EQUAL, 0, 1, 0, 1, sub=None),
+        Op(Tag.DELETE, 1, 3, 1, 1, sub=None),
+    ]
+    assert compose(first, second) == [Op(Tag.EQUAL, 0, 1, 0, 1, sub=None)]
+
+
+def test_compose_mismatched() -> None:
+    first = [Op(Tag.INSERT, 0, 0, 0, 2, sub=None)]
+    second = [Op(Tag.DELETE, 0, 1, 0, 0, sub=None)]
+    with pytest.raises(ValueError):
+        compose(first, second)
+
+
+def test_compose_chain() -> None:
+    trees = versions()
+    for start in range(len(trees)):
+        for end in range(start, len(trees)):
+            operations = diff(trees[start], trees[start])
+            for before, after in zip(trees[start:end], trees[start + 1 :]):
+                operations = compose(operations, diff(before, after))
+            actual = rebuild(trees[start], trees[end], operations)
+            assert actual == trees[end]
+
+            actual = rebuild(trees[end], trees[start], invert(operations))
+            assert actual == trees[start]
@@ -15,9 +15,16 @@
 # Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA
 # 02111-1307, USA.
 
-from helpers.tree import MockAdapter
+from difflib import SequenceMatcher
+from typing import List, Optional, Sequence
+
+import pytest
+from helpers.tree import KeyedAdapter, MockAdapter
 from helpers.tree import MockNode as N
+from helpers.tree import TextAdapter
 
+from fladrif import treediff
+from fladrif.treediff import Adapter, DiffStats
 from fladrif.treediff import Operation as Op
 from fladrif.treediff import Tag, TreeMatcher
 
@@ -152,3 +159,711 @@ def test_structure() -> None:
             ],
         )
     ]
+
+
+def test_similarity_disabled() -> None:
+    before = N(1).add(N(2).add(N(3)).add(N(4)))
+    after = N(1).add(N(5).add(N(3)).add(N(4)))
+    adapter = MockAdapter()
+    matcher = TreeMatcher(adapter, before, after)
+    actual = matcher.compute_operations()
+
+    assert actual == [
+        Op(
+            Tag.DESCEND,
+            0,
+            1,
+            0,
+            1,
+            sub=[
+                Op(Tag.REPLACE, 0, 1, 0, 1, sub=None),
+            ],
+        )
+    ]
+
+
+def test_similarity_pairs_nodes() -> None:
+    before = N(1).add(N(2).add(N(3)).add(N(4))).add(N(6))
+    after = N(1).add(N(5).add(N(3)).add(N(4)).add(N(7))).add(N(8))
+    adapter = MockAdapter()
+    matcher = TreeMatcher(adapter, before, after, similarity=0.5)
+    actual = matcher.compute_operations()
+
+    assert actual == [
+        Op(
+            Tag.DESCEND,
+            0,
+            1,
+            0,
+            1,
+            sub=[
+                Op(
+                    Tag.DESCEND,
+                    0,
+                    1,
+                    0,
+                    1,
+                    sub=[
+                        Op(Tag.EQUAL, 0, 2, 0, 2, sub=None),
+                        Op(Tag.INSERT, 2, 2, 2, 3, sub=None),
+                    ],
+                ),
+                Op(Tag.REPLACE, 1, 2, 1, 2, sub=None),
+            ],
+        )
+    ]
+
+
+def test_similarity_root() -> None:
+    before = N(1).add(N(3)).add(N(4))
+    after = N(2).add(N(3)).add(N(4))
+    adapter = MockAdapter()
+    matcher = TreeMatcher(adapter, before, after, similarity=0.5)
+    actual = matcher.compute_operations()
+
+    assert actual == [
+        Op(
+            Tag.DESCEND,
+            0,
+            1,
+            0,
+            1,
+            sub=[Op(Tag.EQUAL, 0, 2, 0, 2, sub=None)],
+        )
+    ]
+
+
+def test_similarity_below_threshold() -> None:
+    before = N(1).add(N(2).add(N(3)).add(N(4)))
+    after = N(1).add(N(5).add(N(3)).add(N(6)))
+    adapter = MockAdapter()
+    matcher = TreeMatcher(adapter, before, after, similarity=0.75)
+    actual = matcher.compute_operations()
+
+    assert actual == [
+        Op(
+            Tag.DESCEND,
+            0,
+            1,
+            0,
+            1,
+            sub=[
+                Op(Tag.REPLACE, 0, 1, 0, 1, sub=None),
+            ],
+        )
+    ]
+
+
+def test_similarity_budget() -> None:
+    before = N(1).add(N(2).add(N(3)).add(N(4)))
+    after = N(1).add(N(5).add(N(3)).add(N(4)))
+    adapter = MockAdapter()
+    matcher = TreeMatcher(
+        adapter, before, after, similarity=0.5, similarity_budget=0
+    )
+    actual = matcher.compute_operations()
+
+    assert actual == [
+        Op(
+            Tag.DESCEND,
+            0,
+            1,
+            0,
+            1,
+            sub=[
+                Op(Tag.REPLACE, 0, 1, 0, 1, sub=None),
+            ],
+        )
+    ]
+
+
+def test_keyed_moves() -> None:
+    before = (
+        N(0)
+        .add(N(1, key=1))
+        .add(N(2, key=2).add(N(5)))
+        .add(N(3, key=3))
+        .add(N(4, key=4))
+    )
+    after = (
+        N(0)
+        .add(N(3, key=3))
+        .add(N(1, key=1))
+        .add(N(2, key=2).add(N(6)))
+        .add(N(4, key=4))
+        .add(N(7, key=7))
+    )
+    adapter = KeyedAdapter()
+    matcher = TreeMatcher(adapter, before, after)
+    actual = matcher.compute_operations()
+
+    assert actual == [
+        Op(
+            Tag.DESCEND,
+            0,
+            1,
+            0,
+            1,
+            sub=[
+                Op(Tag.INSERT, 0, 0, 0, 1, sub=None),
+                Op(Tag.EQUAL, 0, 1, 1, 2, sub=None),
+                Op(
+                    Tag.DESCEND,
+                    1,
+                    2,
+                    2,
+                    3,
+                    sub=[Op(Tag.REPLACE, 0, 1, 0, 1, sub=None)],
+                ),
+                Op(Tag.DELETE, 2, 3, 3, 3, sub=None),
+                Op(Tag.EQUAL, 3, 4, 3, 4, sub=None),
+                Op(Tag.INSERT, 4, 4, 4, 5, sub=None),
+            ],
+        )
+    ]
+
+
+def test_keyed_does_not_pair_different_keys() -> None:
+    before = N(0).add(N(1, key=1))
+    after = N(0).add(N(1, key=2))
+    adapter = KeyedAdapter()
+    matcher = TreeMatcher(adapter, before, after)
+    actual = matcher.compute_operations()
+
+    assert actual == [
+        Op(
+            Tag.DESCEND,
+            0,
+            1,
+            0,
+            1,
+            sub=[Op(Tag.REPLACE, 0, 1, 0, 1, sub=None)],
+        )
+    ]
+
+
+def test_keyed_falls_back_without_keys() -> None:
+    before = N(0).add(N(1, key=1)).add(N(2))
+    after = N(0).add(N(2)).add(N(1, key=2))
+    adapter = KeyedAdapter()
+    matcher = TreeMatcher(adapter, before, after)
+    actual = matcher.compute_operations()
+
+    assert actual == [
+        Op(
+            Tag.DESCEND,
+            0,
+            1,
+            0,
+            1,
+            sub=[
+                Op(Tag.INSERT, 0, 0, 0, 1, sub=None),
+                Op(Tag.EQUAL, 0, 1, 1, 2, sub=None),
+                Op(Tag.DELETE, 1, 2, 2, 2, sub=None),
+            ],
+        )
+    ]
+
+
+class CountingMatcher(TreeMatcher[N]):
+    resolved = 0
+
+    def _resolveKeyed(
+        self, a: Sequence[N], b: Sequence[N]
+    ) -> Optional[List[Op]]:
+        self.resolved += 1
+        return super()._resolveKeyed(a, b)
+
+
+def test_cache_reuses_identical_sub_diffs() -> None:
+    def section(value: int) -> N:
+        return N(10).add(N(11).add(N(value))).add(N(12))
+
+    before = N(1)
+    after = N(1)
+    for _ in range(20):
+        before.add(N(2).add(section(3)))
+        after.add(N(2).add(section(4)))
+
+    adapter = MockAdapter()
+    uncached = CountingMatcher(adapter, before, after)
+    expected = uncached.compute_operations()
+
+    cached = CountingMatcher(adapter, before, after, cache_size=4)
+    actual = cached.compute_operations()
+
+    assert actual == expected
+    assert cached.resolved == 4
+    assert uncached.resolved == 61
+
+
+def test_cache_eviction() -> None:
+    before = N(1).add(N(2).add(N(3))).add(N(4).add(N(5)))
+    after = N(1).add(N(2).add(N(6))).add(N(4).add(N(7)))
+    adapter = MockAdapter()
+    expected = TreeMatcher(adapter, before, after).compute_operations()
+
+    matcher = TreeMatcher(adapter, before, after, cache_size=1)
+    assert matcher.compute_operations() == expected
+    assert len(matcher._cache) == 1
+
+
+def test_are_equal() -> None:
+    adapter = MockAdapter()
+    before = N(1).add(N(2).add(N(3)))
+
+    assert TreeMatcher(adapter, before, N(1).add(N(2).add(N(3)))).are_equal()
+    assert not TreeMatcher(adapter, before, N(1).add(N(2))).are_equal()
+
+
+def test_are_equal_early_exit() -> None:
+    class Counting(MockAdapter):
+        calls = 0
+
+        def children(self, node: N) -> List[N]:
+            self.calls += 1
+            return super().children(node)
+
+    before = N(1)
+    after = N(1)
+    for index in range(1000):
+        before.add(N(2).add(N(index)))
+        after.add(N(3 if index == 0 else 2).add(N(index)))
+
+    adapter = Counting()
+
+    assert not TreeMatcher(adapter, before, after).are_equal()
+    assert adapter.calls == 2
+
+
+def test_changed_paths() -> None:
+    before = N(1).add(N(2).add(N(3))).add(N(4)).add(N(5))
+    after = N(1).add(N(2)).add(N(3)).add(N(4)).add(N(6))
+    adapter = MockAdapter()
+    matcher = TreeMatcher(adapter, before, after)
+
+    assert list(matcher.changed_paths()) == [
+        (None, (1,)),
+        ((2,), None),
+        (None, (3,)),
+        ((0, 0), None),
+    ]
+
+
+def test_changed_paths_root() -> None:
+    adapter = MockAdapter()
+    matcher = TreeMatcher(adapter, N(1), N(2))
+
+    assert list(matcher.changed_paths()) == [((), None), (None, ())]
+
+
+def test_changed_paths_updated() -> None:
+    before = N(1).add(N(2).add(N(3)).add(N(4)))
+    after = N(1).add(N(5).add(N(3)).add(N(4)))
+    adapter = MockAdapter()
+    matcher = TreeMatcher(adapter, before, after, similarity=0.5)
+
+    assert list(matcher.changed_paths()) == [((0,), (0,))]
+
+
+def test_diff_stats() -> None:
+    before = N(1).add(N(2).add(N(3))).add(N(4)).add(N(5))
+    after = N(1).add(N(2)).add(N(3)).add(N(4)).add(N(6))
+    adapter = MockAdapter()
+    matcher = TreeMatcher(adapter, before, after)
+
+    assert matcher.diff_stats() == DiffStats(inserted=2, deleted=2, updated=0)
+
+
+def test_diff_stats_same() -> None:
+    before = N(1).add(N(2).add(N(3)))
+    adapter = MockAdapter()
+    matcher = TreeMatcher(adapter, before, before)
+
+    assert matcher.diff_stats() == DiffStats(inserted=0, deleted=0, updated=0)
+
+
+def test_diff_stats_single_pass() -> None:
+    class Counting(MockAdapter):
+        calls = 0
+
+        def children(self, node: N) -> List[N]:
+            self.calls += 1
+            return super().children(node)
+
+    def tree(changed: bool) -> N:
+        root = N(0)
+        for index in range(100):
+            leaf = N(3 if changed and index == 50 else 2)
+            root.add(N(1).add(N(1).add(leaf)))
+        return root
+
+    adapter = Counting()
+    matcher = TreeMatcher(adapter, tree(False), tree(True))
+
+    assert matcher.diff_stats() == DiffStats(inserted=1, deleted=1, updated=0)
+
+    # Every node is visited about once, and nothing is hashed deeply just
+    # to be trimmed.
+    assert adapter.calls <= 2 * 301 + 40
+
+
+class OpaqueAdapter(MockAdapter):
+    def opaque(self, node: N) -> bool:
+        return node.internal >= 100
+
+
+def test_opaque() -> None:
+    before = N(1).add(N(100).add(N(2))).add(N(3).add(N(4)))
+    after = N(1).add(N(100).add(N(5))).add(N(3).add(N(6)))
+    adapter = OpaqueAdapter()
+    matcher = TreeMatcher(adapter, before, after)
+    actual = matcher.compute_operations()
+
+    assert adapter.deep_equals(before.children[0], after.children[0])
+    assert actual == [
+        Op(
+            Tag.DESCEND,
+            0,
+            1,
+            0,
+            1,
+            sub=[
+                Op(Tag.EQUAL, 0, 1, 0, 1, sub=None),
+                Op(
+                    Tag.DESCEND,
+                    1,
+                    2,
+                    1,
+                    2,
+                    sub=[Op(Tag.REPLACE, 0, 1, 0, 1, sub=None)],
+                ),
+            ],
+        )
+    ]
+
+
+def test_scope() -> None:
+    before = (
+        N(1)
+        .add(N(2).add(N(3)))
+        .add(N(4).add(N(5).add(N(6))).add(N(7)))
+        .add(N(8).add(N(9)))
+    )
+    after = (
+        N(1)
+        .add(N(2).add(N(10)))
+        .add(N(4).add(N(5).add(N(11))).add(N(12)))
+        .add(N(8))
+    )
+    adapter = MockAdapter()
+    matcher = TreeMatcher(adapter, before, after, scope=[(1, 0)])
+    actual = matcher.compute_operations()
+
+    assert actual == [
+        Op(
+            Tag.DESCEND,
+            0,
+            1,
+            0,
+            1,
+            sub=[
+                Op(Tag.EQUAL, 0, 1, 0, 1, sub=None),
+                Op(
+                    Tag.DESCEND,
+                    1,
+                    2,
+                    1,
+                    2,
+                    sub=[
+                        Op(
+                            Tag.DESCEND,
+                            0,
+                            1,
+                            0,
+                            1,
+                            sub=[Op(Tag.REPLACE, 0, 1, 0, 1, sub=None)],
+                        ),
+                        Op(Tag.REPLACE, 1, 2, 1, 2, sub=None),
+                    ],
+                ),
+                Op(Tag.EQUAL, 2, 3, 2, 3, sub=None),
+            ],
+        )
+    ]
+    assert list(matcher.changed_paths()) == [
+        ((1, 1), None),
+        (None, (1, 1)),
+        ((1, 0, 0), None),
+        (None, (1, 0, 0)),
+    ]
+
+
+def test_scope_root() -> None:
+    before = N(1).add(N(2))
+    after = N(1).add(N(3))
+    adapter = MockAdapter()
+    expected = TreeMatcher(adapter, before, after).compute_operations()
+    matcher = TreeMatcher(adapter, before, after, scope=[(0,), ()])
+
+    assert matcher.compute_operations() == expected
+
+
+def test_scope_are_equal() -> None:
+    before = N(1).add(N(2).add(N(3))).add(N(4).add(N(5)))
+    after = N(1).add(N(2).add(N(3))).add(N(4).add(N(6)))
+    adapter = MockAdapter()
+
+    assert TreeMatcher(adapter, before, after, scope=[(0,)]).are_equal()
+    assert not TreeMatcher(adapter, before, after, scope=[(1,)]).are_equal()
+
+
+def test_text_edit() -> None:
+    before = N(1).add(N(2, text="hello world")).add(N(3, text="abc"))
+    after = N(1).add(N(2, text="hello there world")).add(N(3, text="xyz"))
+    adapter = TextAdapter()
+    matcher = TreeMatcher(adapter, before, after)
+    actual = matcher.compute_operations()
+
+    assert actual == [
+        Op(
+            Tag.DESCEND,
+            0,
+            1,
+            0,
+            1,
+            sub=[
+                Op(
+                    Tag.REPLACE,
+                    0,
+                    1,
+                    0,
+                    1,
+                    sub=[
+                        Op(Tag.EQUAL, 0, 6, 0, 6, sub=None),
+                        Op(Tag.INSERT, 6, 6, 6, 12, sub=None),
+                        Op(Tag.EQUAL, 6, 11, 12, 17, sub=None),
+                    ],
+                ),
+                Op(Tag.REPLACE, 1, 2, 1, 2, sub=None),
+            ],
+        )
+    ]
+
+
+def text_sub(before: str, after: str) -> Sequence[Op]:
+    matcher = TreeMatcher(
+        TextAdapter(),
+        N(1).add(N(2, text=before)),
+        N(1).add(N(2, text=after)),
+    )
+    [root] = matcher.compute_operations()
+    assert root.sub is not None
+    [op] = root.sub
+    assert op.tag == Tag.REPLACE
+    assert op.sub is not None
+    return op.sub
+
+
+def test_text_edit_long() -> None:
+    before = "the quick brown fox " * 5000
+    after = before[:50_000] + "X" + before[50_001:]
+
+    assert text_sub(before, after) == [
+        Op(Tag.EQUAL, 0, 50_000, 0, 50_000, sub=None),
+        Op(Tag.REPLACE, 50_000, 50_001, 50_000, 50_001, sub=None),
+        Op(Tag.EQUAL, 50_001, 100_000, 50_001, 100_000, sub=None),
+    ]
+
+
+def test_text_edit_large_window() -> None:
+    before = "the quick brown fox " * 5000
+    after = before[:10] + "X" + before[11:90_000] + "X" + before[90_001:]
+
+    assert text_sub(before, after) == [
+        Op(Tag.EQUAL, 0, 10, 0, 10, sub=None),
+        Op(Tag.REPLACE, 10, 90_001, 10, 90_001, sub=None),
+        Op(Tag.EQUAL, 90_001, 100_000, 90_001, 100_000, sub=None),
+    ]
+
+
+def shared(depth: int, leaf: int) -> N:
+    node = N(leaf)
+    for level in range(depth):
+        node = N(level).add(node).add(node)
+    return node
+
+
+def test_shared_nodes_deep_hash() -> None:
+    adapter = MockAdapter()
+    lhs = shared(64, 1)
+    rhs = shared(64, 1)
+
+    assert adapter.deep_hash(lhs) == adapter.deep_hash(rhs)
+    assert adapter.deep_hash(lhs) != adapter.deep_hash(shared(64, 2))
+    assert adapter.deep_equals(lhs, rhs)
+    assert not adapter.deep_equals(lhs, shared(64, 2))
+
+
+class Proxy:
+    def __init__(self, node: N) -> None:
+        self.node = node
+
+
+class ProxyAdapter(Adapter[Proxy]):
+    """Creates fresh proxies on every call, like lxml-style bindings."""
+
+    def shallow_equals(self, lhs: Proxy, rhs: Proxy) -> bool:
+        return lhs.node.internal == rhs.node.internal
+
+    def shallow_hash(self, node: Proxy) -> int:
+        return hash(node.node.internal)
+
+    def children(self, node: Proxy) -> List[Proxy]:
+        return [Proxy(c) for c in node.node.children]
+
+
+def test_deep_equals_proxies() -> None:
+    def chain(leaf: int) -> N:
+        node = N(leaf)
+        for _ in range(50):
+            node = N(0).add(node)
+        return node
+
+    adapter = ProxyAdapter()
+
+    assert not adapter.deep_equals(Proxy(chain(2)), Proxy(chain(3)))
+    assert adapter.deep_equals(Proxy(chain(2)), Proxy(chain(2)))
+
+
+def test_shared_nodes_diff() -> None:
+    common = shared(64, 1)
+    before = N(0).add(common).add(shared(64, 2))
+    after = N(0).add(common).add(shared(64, 3))
+    adapter = MockAdapter()
+    matcher = TreeMatcher(adapter, before, after, shared=True)
+
+    assert not matcher.are_equal()
+
+    sub = matcher.compute_operations()[0].sub
+    assert sub is not None
+    assert sub[0] == Op(Tag.EQUAL, 0, 1, 0, 1, sub=None)
+    assert sub[1].tag == Tag.DESCEND
+
+    # Operations for shared pairs are shared as well.
+    assert sub[1].sub is not None
+    assert sub[1].sub[0].sub is sub[1].sub[1].sub
+
+
+def test_shared_nodes_stats() -> None:
+    before = shared(4, 2)
+    after = shared(4, 3)
+    adapter = MockAdapter()
+    matcher = TreeMatcher(adapter, before, after, shared=True)
+
+    # Statistics count every path to a changed node.
+    assert matcher.diff_stats() == DiffStats(
+        inserted=16, deleted=16, updated=0
+    )
+
+
+def test_shared_nodes_off_by_default() -> None:
+    before = N(0).add(N(1).add(N(2))).add(N(3))
+    after = N(0).add(N(1).add(N(4))).add(N(3))
+    adapter = MockAdapter()
+    matcher = TreeMatcher(adapter, before, after)
+    expected = matcher.compute_operations()
+
+    # Nothing is remembered by identity unless asked for.
+    assert not matcher._resolved
+    assert matcher._adapter.deep is adapter
+
+    shared = TreeMatcher(adapter, before, after, shared=True)
+    assert shared.compute_operations() == expected
+
+
+def test_identical_object_short_circuits() -> None:
+    class Forbidden(MockAdapter):
+        def deep_hash(self, node: N) -> int:
+            raise AssertionError("hashed")
+
+    common = N(2).add(N(3))
+    before = N(1).add(common)
+    adapter = Forbidden()
+    matcher = TreeMatcher(adapter, before, before)
+
+    assert matcher.compute_operations() == [
+        Op(
+            Tag.DESCEND,
+            0,
+            1,
+            0,
+            1,
+            sub=[Op(Tag.EQUAL, 0, 1, 0, 1, sub=None)],
+        )
+    ]
+
+
+def test_trim_common_runs(monkeypatch: pytest.MonkeyPatch) -> None:
+    lengths = []
+
+    class Recording(SequenceMatcher[object]):
+        def set_seqs(self, a: Sequence[object], b: Sequence[object]) -> None:
+            lengths.append((len(a), len(b)))
+            super().set_seqs(a, b)
+
+    monkeypatch.setattr(treediff, "SequenceMatcher", Recording)
+
+    before = N(0)
+    after = N(0)
+    for index in range(1000):
+        before.add(N(index).add(N(index)))
+        after.add(N(index).add(N(-1 if index == 500 else index)))
+
+    adapter = MockAdapter()
+    matcher = TreeMatcher(adapter, before, after)
+    actual = matcher.compute_operations()
+
+    assert actual == [
+        Op(
+            Tag.DESCEND,
+            0,
+            1,
+            0,
+            1,
+            sub=[
+                Op(Tag.EQUAL, 0, 500, 0, 500, sub=None),
+                Op(
+                    Tag.DESCEND,
+                    500,
+                    501,
+                    500,
+                    501,
+                    sub=[Op(Tag.REPLACE, 0, 1, 0, 1, sub=None)],
+                ),
+                Op(Tag.EQUAL, 501, 1000, 501, 1000, sub=None),
+            ],
+        )
+    ]
+    assert max(lengths) == (1, 1)
+
+
+def test_trim_insert_at_end() -> None:
+    before = N(0).add(N(1)).add(N(2))
+    after = N(0).add(N(1)).add(N(2)).add(N(3))
+    adapter = MockAdapter()
+    matcher = TreeMatcher(adapter, before, after)
+
+    assert matcher.compute_operations() == [
+        Op(
+            Tag.DESCEND,
+            0,
+            1,
+            0,
+            1,
+            sub=[
+                Op(Tag.EQUAL, 0, 2, 0, 2, sub=None),
+                Op(Tag.INSERT, 2, 2, 2, 3, sub=None),
+            ],
+        )
+    ]